@@ -1,4 +1,12 @@
 from django.contrib import admin
-from .models import User
+from .models import OutgoingEmail, User
+
+
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to_email', 'status', 'num_attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to_email',)
+
 
 admin.site.register(User)
+admin.site.register(OutgoingEmail, OutgoingEmailAdmin)
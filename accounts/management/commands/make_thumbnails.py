@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from accounts import thumbnails
+from accounts.models import User
+from infos.fragment_cache import bump_fragment_version
+
+
+class Command(BaseCommand):
+    help = 'Make the thumbnails of the profile pictures that have none yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='all',
+                            help='Also check the users that have thumbnails and remake missing variants.')
+
+    def handle(self, *args, **options):
+        user_qs = User.objects.all()
+        if not options['all']:
+            user_qs = user_qs.filter(picture_hash='')
+        # most users share a few pictures, the default one above all
+        hashes = {}
+        num_users = 0
+        for user_id, picture_name, picture_hash in user_qs.values_list('id', 'picture', 'picture_hash'):
+            if not picture_name:
+                continue
+            if picture_name not in hashes:
+                hashes[picture_name] = thumbnails.make_thumbnails(User(picture=picture_name).picture)
+            if hashes[picture_name] != picture_hash:
+                User.objects.filter(id=user_id).update(picture_hash=hashes[picture_name])
+                num_users += 1
+        # update() sends no signals
+        bump_fragment_version('sidebar')
+        bump_fragment_version('post_card')
+        self.stdout.write(self.style.SUCCESS('Made the thumbnails of {} pictures for {} users.'.format(
+            len(hashes), num_users)))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.models import OutgoingEmail
+
+
+class Command(BaseCommand):
+    help = 'Deliver the queued emails in batches, each batch over one mail server connection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Emails sent per connection.')
+        parser.add_argument('--loop', action='store_true', dest='loop',
+                            help='Keep running, polling the outbox when it is empty.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait before polling an empty outbox again.')
+
+    def handle(self, *args, **options):
+        total_sent = 0
+        total_failed = 0
+        while True:
+            num_sent, num_failed = OutgoingEmail.send_due(batch_size=options['batch_size'])
+            total_sent += num_sent
+            total_failed += num_failed
+            if num_sent or num_failed:
+                self.stdout.write('Sent {}, failed {}.'.format(num_sent, num_failed))
+            if num_sent + num_failed < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Sent {} emails, {} attempts failed.'.format(
+            total_sent, total_failed)))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def backfill_num_unread_noties(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    Notify = apps.get_model('infos', 'Notify')
+    unread_counts = Notify.objects.filter(
+        seen=False,
+        to_user__isnull=False
+    ).order_by().values_list('to_user_id').annotate(num=models.Count('id'))
+    for user_id, num_unread in unread_counts:
+        User.objects.filter(pk=user_id).update(num_unread_noties=num_unread)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_auto_20170812_0921'),
+        ('infos', '0013_auto_20261019_0309'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='num_unread_noties',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_num_unread_noties, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_user_num_unread_noties'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='picture_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
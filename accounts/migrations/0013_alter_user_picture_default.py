@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='picture',
+            field=models.ImageField(default='profile_pic/profile.jpg', upload_to='profile_pic'),
+        ),
+    ]
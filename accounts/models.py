@@ -1,11 +1,17 @@
+from datetime import timedelta
+
 from django.contrib.auth.models import AbstractUser
+from django.core.mail import EmailMessage, get_connection
 from django.db import models
-from django.db.models import Avg
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils import timezone
 
 from infos import models as infos_models
-from infos.models import Notify
+from infos.fragment_cache import bump_fragment_version
+from . import thumbnails
 
 GENDER_CHOICES = (
     ('M', 'Male'), ('F', 'Female')
@@ -24,7 +30,10 @@ class User(AbstractUser):
     district = models.ForeignKey(infos_models.District, related_name='district_users', null=True, blank=True)
     intro_yourself = models.TextField(max_length=256, null=True, blank=True)
     picture = models.ImageField(upload_to='profile_pic', default='profile_pic/profile.jpg')
+    # names the thumbnails of picture, empty until they are made
+    picture_hash = models.CharField(max_length=40, blank=True, default='')
     is_active = models.BooleanField(default=False)
+    num_unread_noties = models.IntegerField(default=0)
 
     def __str__(self):
         return self.username
@@ -32,8 +41,17 @@ class User(AbstractUser):
     def get_absolute_url(self):
         return reverse('accounts:profile', kwargs={'pk': self.pk})
 
+    def get_rating_summary(self):
+        try:
+            return self.rating_summary
+        except infos_models.RatingSummary.DoesNotExist:
+            return None
+
     def count_raters(self):
-        return infos_models.Rating.objects.filter(to_user=self).count()
+        summary = self.get_rating_summary()
+        if summary is None:
+            return 0
+        return summary.num_raters
 
     def get_rating_other(self, user_id):
         user = get_object_or_404(User, id=user_id)
@@ -44,20 +62,157 @@ class User(AbstractUser):
             return 0
 
     def calculate_avg_rating(self):
-        rating_qs = infos_models.Rating.objects.filter(to_user=self)
-        num_rating = rating_qs.count()
-        rating_avg = rating_qs.aggregate(Avg('rating'))['rating__avg']
-        if rating_avg is None:
+        summary = self.get_rating_summary()
+        if summary is None:
             return 0
-
-        if num_rating < 3:
-            return (num_rating * rating_avg) / 3
-
-        return rating_avg
+        return summary.avg_rating
 
     def str_avg_rating(self):
         avg = self.calculate_avg_rating()
         return '{:03.2f}'.format(avg)
 
     def get_num_unread_noties(self):
-        return Notify.objects.filter(to_user=self, seen=False).count()
+        return self.num_unread_noties
+
+    def get_picture_url(self, size, ext='jpg'):
+        return thumbnails.picture_url(self, size, ext)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # the stored picture, make_picture_thumbnails only works on a picture that changed
+        picture = user.__dict__.get('picture')
+        user._loaded_picture = getattr(picture, 'name', picture)
+        return user
+
+
+class OutgoingEmail(models.Model):
+    """
+    Outbox of the emails the site sends, delivered by the send_queued_emails command so that no
+    request waits on the mail server. Meant for a single worker.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'pending'),
+        (SENT, 'sent'),
+        (FAILED, 'failed')
+    )
+    # retries wait RETRY_DELAY seconds, doubled after every failure up to MAX_RETRY_DELAY
+    MAX_ATTEMPTS = 8
+    RETRY_DELAY = 60
+    MAX_RETRY_DELAY = 6 * 60 * 60
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    to_email = models.EmailField()
+    status = models.CharField(choices=STATUS_CHOICES, max_length=10, default=PENDING)
+    num_attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outgoing_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return '{} to {}'.format(self.subject, self.to_email)
+
+    @classmethod
+    def enqueue(cls, subject, body, to_email):
+        return cls.objects.create(subject=subject, body=body, to_email=to_email)
+
+    def get_retry_delay(self):
+        return min(self.RETRY_DELAY * 2 ** (self.num_attempts - 1), self.MAX_RETRY_DELAY)
+
+    def mark_failed_attempt(self, error):
+        self.num_attempts += 1
+        self.last_error = str(error)
+        if self.num_attempts >= self.MAX_ATTEMPTS:
+            self.status = self.FAILED
+        else:
+            self.next_attempt_at = timezone.now() + timedelta(seconds=self.get_retry_delay())
+        self.save(update_fields=['num_attempts', 'last_error', 'status', 'next_attempt_at'])
+
+    @classmethod
+    def send_due(cls, batch_size=50):
+        """
+        Send up to batch_size emails that are due over a single mail server connection, returns
+        (number sent, number failed). Failed emails are retried later with a growing delay.
+        """
+        emails = list(cls.objects.filter(
+            status=cls.PENDING,
+            next_attempt_at__lte=timezone.now()
+        ).order_by('next_attempt_at', 'id')[:batch_size])
+        if not emails:
+            return 0, 0
+        connection = get_connection()
+        try:
+            connection.open()
+        except Exception as error:
+            # the server is unreachable, the whole batch waits
+            for email in emails:
+                email.mark_failed_attempt(error)
+            return 0, len(emails)
+        num_sent = 0
+        try:
+            for email in emails:
+                message = EmailMessage(email.subject, email.body, to=[email.to_email], connection=connection)
+                try:
+                    message.send()
+                except Exception as error:
+                    email.mark_failed_attempt(error)
+                    # the connection may be unusable after an error, start a fresh one
+                    connection.close()
+                    try:
+                        connection.open()
+                    except Exception:
+                        pass
+                    continue
+                email.status = cls.SENT
+                email.num_attempts += 1
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                email.save(update_fields=['status', 'num_attempts', 'sent_at', 'last_error'])
+                num_sent += 1
+        finally:
+            connection.close()
+        return num_sent, len(emails) - num_sent
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_fragments(sender, update_fields=None, **kwargs):
+    # a login only touches last_login, which no fragment shows
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_fragment_version('sidebar')
+    bump_fragment_version('post_card')
+
+
+@receiver(pre_save, sender=User)
+def make_picture_thumbnails(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and 'picture' not in update_fields):
+        return
+    # a new upload is not committed to the storage yet. An unchanged picture is left alone even
+    # without thumbnails, they failed before and make_thumbnails (the command) retries them
+    picture_name = instance.picture.name or ''
+    if instance.picture._committed and picture_name == getattr(instance, '_loaded_picture', None):
+        return
+    if not picture_name:
+        instance.picture_hash = ''
+    elif instance.picture._committed and picture_name == sender._meta.get_field('picture').default:
+        # every new user starts with it
+        instance.picture_hash = thumbnails.make_shared_thumbnails(instance.picture)
+    else:
+        instance.picture_hash = thumbnails.make_thumbnails(instance.picture)
+
+
+@receiver(post_save, sender=User)
+def remember_saved_picture(sender, instance, **kwargs):
+    # an upload only gets its final name once saved
+    instance._loaded_picture = instance.picture.name or ''
@@ -1,3 +1,200 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from . import thumbnails
+from .models import OutgoingEmail, User
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionError('mail server went away')
+
+
+class UnreachableEmailBackend(BaseEmailBackend):
+    def open(self):
+        raise ConnectionRefusedError('mail server unreachable')
+
+    def send_messages(self, email_messages):
+        raise AssertionError('nothing is sent without a connection')
+
+
+# the test runner switches to the locmem backend, mail.outbox gets what was sent
+class OutgoingEmailTests(TestCase):
+    def enqueue(self, number=1):
+        return [OutgoingEmail.enqueue('Subject {}'.format(i), 'Body {}'.format(i), 'user{}@example.com'.format(i))
+                for i in range(number)]
+
+    def test_enqueue_only_stores(self):
+        email, = self.enqueue()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.num_attempts, 0)
+        self.assertLessEqual(email.next_attempt_at, timezone.now())
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_send_due(self):
+        self.enqueue(3)
+        self.assertEqual(OutgoingEmail.send_due(), (3, 0))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['user0@example.com', 'user1@example.com', 'user2@example.com'])
+        for email in OutgoingEmail.objects.all():
+            self.assertEqual(email.status, OutgoingEmail.SENT)
+            self.assertEqual(email.num_attempts, 1)
+            self.assertIsNotNone(email.sent_at)
+        # nothing left to send
+        self.assertEqual(OutgoingEmail.send_due(), (0, 0))
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_send_due_batch_size_and_not_due(self):
+        emails = self.enqueue(3)
+        OutgoingEmail.objects.filter(id=emails[0].id).update(next_attempt_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(OutgoingEmail.send_due(batch_size=1), (1, 0))
+        self.assertEqual(OutgoingEmail.send_due(batch_size=5), (1, 0))
+        self.assertEqual(OutgoingEmail.objects.get(id=emails[0].id).status, OutgoingEmail.PENDING)
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.FailingEmailBackend')
+    def test_failed_send_backs_off(self):
+        email, = self.enqueue()
+        for num_attempts, delay in ((1, OutgoingEmail.RETRY_DELAY), (2, OutgoingEmail.RETRY_DELAY * 2)):
+            before = timezone.now()
+            self.assertEqual(OutgoingEmail.send_due(), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual(email.status, OutgoingEmail.PENDING)
+            self.assertEqual(email.num_attempts, num_attempts)
+            self.assertIn('mail server went away', email.last_error)
+            self.assertGreaterEqual(email.next_attempt_at, before + timedelta(seconds=delay))
+            self.assertLessEqual(email.next_attempt_at, timezone.now() + timedelta(seconds=delay))
+            # not due yet
+            self.assertEqual(OutgoingEmail.send_due(), (0, 0))
+            OutgoingEmail.objects.filter(id=email.id).update(next_attempt_at=timezone.now())
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.UnreachableEmailBackend')
+    def test_unreachable_server_fails_the_batch(self):
+        self.enqueue(2)
+        self.assertEqual(OutgoingEmail.send_due(), (0, 2))
+        self.assertEqual(OutgoingEmail.objects.filter(num_attempts=1, status=OutgoingEmail.PENDING).count(), 2)
+
+    def test_retry_delay_is_capped(self):
+        email = OutgoingEmail(num_attempts=30)
+        self.assertEqual(email.get_retry_delay(), OutgoingEmail.MAX_RETRY_DELAY)
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.FailingEmailBackend')
+    def test_gives_up_after_max_attempts(self):
+        email, = self.enqueue()
+        for _ in range(OutgoingEmail.MAX_ATTEMPTS):
+            self.assertEqual(OutgoingEmail.send_due(), (0, 1))
+            OutgoingEmail.objects.filter(id=email.id).update(next_attempt_at=timezone.now())
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.FAILED)
+        self.assertEqual(email.num_attempts, OutgoingEmail.MAX_ATTEMPTS)
+        # given up, not picked up again
+        self.assertEqual(OutgoingEmail.send_due(), (0, 0))
+
+
+def make_image(color='red', size=(300, 200), fmt='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+# the test runner stores the files in a temporary MEDIA_ROOT
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        thumbnails._shared_hashes.clear()
+        self.formats = [ext for ext, _ in thumbnails.get_formats()]
+
+    def assertThumbnails(self, picture_hash):
+        for size in thumbnails.THUMBNAIL_SIZES:
+            for ext in self.formats:
+                with default_storage.open(thumbnails.thumbnail_name(picture_hash, size, ext)) as thumbnail:
+                    self.assertEqual(Image.open(thumbnail).size, (size, size))
+
+    def test_upload(self):
+        user = User.objects.create_user('anna')
+        user.picture = SimpleUploadedFile('anna.png', make_image())
+        user.save()
+        self.assertEqual(len(user.picture_hash), 40)
+        self.assertThumbnails(user.picture_hash)
+        self.assertEqual(user.get_picture_url(50), default_storage.url(
+            thumbnails.thumbnail_name(user.picture_hash, 64, 'jpg')))
+
+    def test_same_picture_stored_once(self):
+        picture_hash = thumbnails.make_thumbnails(User(picture=SimpleUploadedFile('a.png', make_image())).picture)
+        with mock.patch.object(default_storage, 'save') as save:
+            self.assertEqual(
+                thumbnails.make_thumbnails(User(picture=SimpleUploadedFile('b.png', make_image())).picture),
+                picture_hash
+            )
+        save.assert_not_called()
+
+    def test_not_an_image(self):
+        picture = User(picture=SimpleUploadedFile('notes.png', b'not an image')).picture
+        self.assertEqual(thumbnails.make_thumbnails(picture), '')
+        self.assertEqual(thumbnails.make_thumbnails(User(picture='profile_pic/missing.jpg').picture), '')
+
+    def test_unchanged_picture_not_reread(self):
+        user = User.objects.create_user('anna')
+        with mock.patch('accounts.thumbnails.make_thumbnails') as make_thumbnails:
+            user.first_name = 'Anna'
+            user.save()
+            User.objects.get(id=user.id).save()
+        make_thumbnails.assert_not_called()
+
+    def test_default_picture_hashed_once(self):
+        default_name = User._meta.get_field('picture').default
+        default_storage.save(default_name, ContentFile(make_image('blue', fmt='JPEG')))
+        try:
+            with mock.patch('accounts.thumbnails.make_thumbnails', wraps=thumbnails.make_thumbnails) as make:
+                users = [User.objects.create_user('user{}'.format(i)) for i in range(3)]
+            self.assertEqual(make.call_count, 1)
+            self.assertEqual(len({user.picture_hash for user in users}), 1)
+            self.assertThumbnails(users[0].picture_hash)
+        finally:
+            default_storage.delete(default_name)
+
+    def test_pick_size(self):
+        for size, thumbnail_size in ((1, 30), (30, 30), (31, 64), (100, 256), (1000, 256)):
+            self.assertEqual(thumbnails.pick_size(size), thumbnail_size)
+
+    def test_accepted_format(self):
+        with mock.patch('accounts.thumbnails.features.check', return_value=True):
+            self.assertEqual(thumbnails.accepted_format('image/webp,image/apng,image/*,*/*;q=0.8'), 'webp')
+            self.assertEqual(thumbnails.accepted_format('image/png,image/*;q=0.8'), 'jpg')
+        with mock.patch('accounts.thumbnails.features.check', return_value=False):
+            self.assertEqual(thumbnails.accepted_format('image/webp,*/*'), 'jpg')
+        self.assertEqual(thumbnails.accepted_format(''), 'jpg')
+
+    def test_picture_url_without_thumbnails(self):
+        user = User(picture='profile_pic/anna.png')
+        self.assertEqual(user.get_picture_url(30), user.picture.url)
+
+    def test_command(self):
+        name = default_storage.save('profile_pic/shared.png', ContentFile(make_image('green')))
+        users = [User.objects.create_user('user{}'.format(i)) for i in range(3)]
+        User.objects.filter(id__in=[user.id for user in users]).update(picture=name, picture_hash='')
+        out = io.StringIO()
+        call_command('make_thumbnails', stdout=out)
+        self.assertIn('Made the thumbnails of 1 pictures for 3 users.', out.getvalue())
+        picture_hashes = set(User.objects.filter(id__in=[user.id for user in users]).values_list(
+            'picture_hash', flat=True))
+        self.assertEqual(len(picture_hashes), 1)
+        picture_hash = picture_hashes.pop()
+        self.assertThumbnails(picture_hash)
+
+        # only --all looks at the users that have thumbnails
+        lost = thumbnails.thumbnail_name(picture_hash, 64, 'jpg')
+        default_storage.delete(lost)
+        call_command('make_thumbnails', stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(lost))
+        call_command('make_thumbnails', '--all', stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(lost))
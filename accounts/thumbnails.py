@@ -0,0 +1,104 @@
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+# square variants of the profile pictures, shown in circles of about these sizes
+THUMBNAIL_SIZES = (30, 64, 256)
+# extension -> Pillow format, the first one the browser accepts is served
+THUMBNAIL_FORMATS = (
+    ('webp', 'WEBP'),
+    ('jpg', 'JPEG'),
+)
+THUMBNAIL_DIR = 'profile_pic/thumbs'
+THUMBNAIL_QUALITY = 85
+
+
+def get_formats():
+    """The formats this Pillow can write, WebP needs libwebp."""
+    return [(ext, fmt) for ext, fmt in THUMBNAIL_FORMATS if fmt != 'WEBP' or features.check('webp')]
+
+
+def thumbnail_name(picture_hash, size, ext):
+    # content-hashed, the same picture is only stored once and its urls can be cached forever
+    return '{}/{}/{}_{}.{}'.format(THUMBNAIL_DIR, picture_hash[:2], picture_hash, size, ext)
+
+
+def make_thumbnails(picture):
+    """
+    Store every variant of picture (a FieldFile, saved or freshly uploaded) and return the hash
+    they are named after, or '' when the file is missing or not an image.
+    """
+    try:
+        picture.open('rb')
+        picture.seek(0)
+        data = picture.read()
+        picture.seek(0)
+    except (IOError, OSError, ValueError):
+        return ''
+    finally:
+        # a fresh upload has to stay open until the model saves it
+        if picture._committed:
+            picture.close()
+    picture_hash = hashlib.sha1(data).hexdigest()
+    formats = get_formats()
+    missing = [
+        (size, ext, fmt) for size in THUMBNAIL_SIZES for ext, fmt in formats
+        if not default_storage.exists(thumbnail_name(picture_hash, size, ext))
+    ]
+    if not missing:
+        return picture_hash
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image) if hasattr(ImageOps, 'exif_transpose') else image
+        image = image.convert('RGB')
+    except (IOError, OSError, ValueError):
+        return ''
+    for size, ext, fmt in missing:
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, fmt, quality=THUMBNAIL_QUALITY)
+        default_storage.save(thumbnail_name(picture_hash, size, ext), ContentFile(buffer.getvalue()))
+    return picture_hash
+
+
+# (media root, picture name) -> hash of a picture many users share, the default one
+_shared_hashes = {}
+
+
+def make_shared_thumbnails(picture):
+    """make_thumbnails of a picture shared by many users, read and hashed once per process."""
+    # the media root is part of the key for the tests, which store their files elsewhere
+    key = (settings.MEDIA_ROOT, picture.name)
+    if key not in _shared_hashes:
+        picture_hash = make_thumbnails(picture)
+        if not picture_hash:
+            return ''
+        _shared_hashes[key] = picture_hash
+    return _shared_hashes[key]
+
+
+def pick_size(size):
+    """The smallest variant at least size pixels wide, the largest one otherwise."""
+    for thumbnail_size in THUMBNAIL_SIZES:
+        if thumbnail_size >= size:
+            return thumbnail_size
+    return THUMBNAIL_SIZES[-1]
+
+
+def accepted_format(accept_header):
+    """Extension of the best variant for a browser sending this Accept header."""
+    for ext, fmt in get_formats():
+        if fmt == 'JPEG' or 'image/{}'.format(ext) in accept_header:
+            return ext
+    return 'jpg'
+
+
+def picture_url(user, size, ext='jpg'):
+    """Url of the user's picture variant fitting size, the original until the thumbnails exist."""
+    if not user.picture_hash:
+        return user.picture.url
+    return default_storage.url(thumbnail_name(user.picture_hash, pick_size(size), ext))
@@ -16,4 +16,5 @@ urlpatterns = [
     url(r'^(?P<pk>\d+)/edit/$', views.ProfileEditView.as_view(), name='edit_profile'),
     url(r'^(?P<user_id>\d+)/vote/(?P<rating>\d+)/', views.vote_user_view, name='vote_user'),
     url(r'^seen/$', views.set_seen_noties, name='seen_noties'),
+    url(r'^noties/$', views.noties_feed_view, name='noties_feed'),
 ]
@@ -1,28 +1,32 @@
 from django.contrib.auth import authenticate, login
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMessage
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.db.models import Q
 from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render, redirect
 from django.template.loader import render_to_string
+from django.utils import formats, timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.views.generic import DetailView, UpdateView
 
-from infos.models import Rating, Notify
+from infos.models import Rating, Notify, RatingSummary
 from posts.models import Post
 from . import forms
-from .models import User
+from .models import OutgoingEmail, User
 
 token_generator = PasswordResetTokenGenerator()
 
 
 def send_email(subject, message, to_email):
-    email = EmailMessage(subject, message, to=[to_email])
-    email.send()
+    """Queue the email, the send_queued_emails worker delivers it."""
+    OutgoingEmail.enqueue(subject, message, to_email)
 
 
 def signup(request):
@@ -35,18 +39,19 @@ def signup(request):
                 form.add_error('email', 'Email is already exist!')
                 return render(request, 'accounts/signup.html', {'form': form})
 
-            user.is_active = False
-            user.save()
-            current_site = get_current_site(request)
-            message = render_to_string('accounts/email_active_account.html', {
-                'user': user,
-                'domain': current_site.domain,
-                'uid': urlsafe_base64_encode(force_bytes(user.pk)),
-                'token': token_generator.make_token(user),
-            })
-            mail_subject = 'Activate your Account !'
-            to_email = form.cleaned_data.get('email')
-            send_email(mail_subject, message, to_email)
+            with transaction.atomic():
+                user.is_active = False
+                user.save()
+                current_site = get_current_site(request)
+                message = render_to_string('accounts/email_active_account.html', {
+                    'user': user,
+                    'domain': current_site.domain,
+                    'uid': urlsafe_base64_encode(force_bytes(user.pk)),
+                    'token': token_generator.make_token(user),
+                })
+                mail_subject = 'Activate your Account !'
+                to_email = form.cleaned_data.get('email')
+                send_email(mail_subject, message, to_email)
             return redirect('accounts:wait_verify_email')
     else:
         form = forms.SignUpForm()
@@ -102,6 +107,9 @@ def login_view(request):
         return render(request, 'accounts/login.html', {'form': form})
 
 
+POSTS_PER_PAGE = 2
+
+
 class UserProfileView(LoginRequiredMixin, DetailView):
     model = User
     template_name = 'accounts/user_detail.html'
@@ -109,8 +117,11 @@ class UserProfileView(LoginRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['user'] = get_object_or_404(User, id=self.kwargs['pk'])
-        post_lists = Post.objects.filter(author_id=self.kwargs['pk'], is_approved=True).order_by('-created_at')
-        paginator = Paginator(post_lists, 2)
+        post_lists = Post.objects.filter(
+            author_id=self.kwargs['pk'],
+            is_approved=True
+        ).order_by('-created_at').select_related('author', 'district', 'subject', 'class_level')
+        paginator = Paginator(post_lists, POSTS_PER_PAGE)
         page = self.request.GET.get('page')
         try:
             post_list = paginator.page(page)
@@ -119,14 +130,10 @@ class UserProfileView(LoginRequiredMixin, DetailView):
         except EmptyPage:
             post_list = paginator.page(paginator.num_pages)
 
-        like_dict = {}
-        for post in post_list:
-            is_liked = post.likes.filter(username=self.request.user.username).exists()
-            like_dict.update({post.id: is_liked})
+        Post.attach_list_stats(post_list, self.request.user)
         context['post_list'] = post_list
         context['paginator'] = paginator
         context['rating'] = self.request.user.get_rating_other(self.kwargs['pk'])
-        context['like_dict'] = like_dict
         return context
 
 
@@ -156,39 +163,42 @@ class ProfileEditView(LoginRequiredMixin, UpdateView):
 def vote_user_view(request, user_id, rating):
     if int(rating) > 5 or int(rating) < 0:
         return HttpResponse("Error rating! olny rate from 0 -> 5 stars !")
+    rating = int(rating)
     user = get_object_or_404(User, id=user_id)
     if user.is_tutor and not request.user.is_tutor and not request.user.is_superuser:
-        is_rated = Rating.objects.filter(
-            from_user=request.user,
-            to_user=user
-        ).exists()
-        if is_rated:
-            rate = Rating.objects.get(
-                from_user=request.user,
-                to_user=user
-            )
-            rate.rating = rating
-            rate.save()
-            Notify.objects.filter(
-                from_user=request.user,
-                to_user=user,
-                noti_type=Notify.RATING,
-            ).update(rating=rating)
-
-        else:
-            rate = Rating.objects.create(
-                from_user=request.user,
-                to_user=user,
-                rating=rating
-            )
-            rate.save()
-            Notify.objects.create(
-                from_user=request.user,
-                to_user=user,
-                noti_type=Notify.RATING,
-                rating=rating,
-                seen=False
-            )
+        with transaction.atomic():
+            try:
+                rate = Rating.objects.select_for_update().get(
+                    from_user=request.user,
+                    to_user=user
+                )
+            except Rating.DoesNotExist:
+                rate = None
+            if rate is not None:
+                old_rating = rate.rating or 0
+                rate.rating = rating
+                rate.save()
+                Notify.objects.filter(
+                    from_user=request.user,
+                    to_user=user,
+                    noti_type=Notify.RATING,
+                ).update(rating=rating)
+                summary = RatingSummary.apply_vote(user, rating, old_rating=old_rating)
+            else:
+                Rating.objects.create(
+                    from_user=request.user,
+                    to_user=user,
+                    rating=rating
+                )
+                Notify.create_noti(
+                    from_user=request.user,
+                    to_user=user,
+                    noti_type=Notify.RATING,
+                    rating=rating,
+                    seen=False
+                )
+                summary = RatingSummary.apply_vote(user, rating)
+        user.rating_summary = summary
         raters = user.count_raters()
         rating_avg = user.str_avg_rating()
         data = {
@@ -201,5 +211,69 @@ def vote_user_view(request, user_id, rating):
         return HttpResponse("Sorry! only student can vote Tutor!")
 
 
+@login_required()
 def set_seen_noties(request):
-    Notify.objects.filter(to_user=request.user).update(seen=True)
+    Notify.set_seen(request.user)
+    return JsonResponse(data={"num_unread_noties": 0})
+
+
+NOTIES_PER_PAGE = 10
+
+
+def encode_noti_cursor(noti):
+    raw = '{}|{}'.format(noti.noti_date.isoformat(), noti.id)
+    return force_text(urlsafe_base64_encode(force_bytes(raw)))
+
+
+def decode_noti_cursor(cursor):
+    try:
+        noti_date, noti_id = force_text(urlsafe_base64_decode(cursor)).split('|')
+        noti_date = parse_datetime(noti_date)
+        noti_id = int(noti_id)
+    except (TypeError, ValueError):
+        return None
+    if noti_date is None:
+        return None
+    return noti_date, noti_id
+
+
+@login_required()
+def noties_feed_view(request):
+    """One page of the user's notifications, newest first, continued with the returned cursor."""
+    noti_qs = Notify.objects.filter(
+        to_user=request.user
+    ).select_related(
+        'from_user', 'noti_post'
+    ).order_by('-noti_date', '-id')
+    cursor = request.GET.get('cursor')
+    if cursor:
+        position = decode_noti_cursor(cursor)
+        if position is None:
+            return JsonResponse(data={"error": "invalid cursor"}, status=400)
+        noti_date, noti_id = position
+        noti_qs = noti_qs.filter(Q(noti_date__lt=noti_date) | Q(noti_date=noti_date, id__lt=noti_id))
+    noti_list = list(noti_qs[:NOTIES_PER_PAGE + 1])
+    has_next = len(noti_list) > NOTIES_PER_PAGE
+    noti_list = noti_list[:NOTIES_PER_PAGE]
+
+    noties = []
+    for noti in noti_list:
+        if noti.noti_type == Notify.RATING:
+            url = reverse('accounts:profile', kwargs={'pk': noti.to_user_id})
+        else:
+            url = reverse('posts:detail_post', kwargs={'pk': noti.noti_post_id})
+        noties.append({
+            "id": noti.id,
+            "noti_type": noti.noti_type,
+            "text": noti.get_noti_str(),
+            "url": url,
+            "picture": noti.from_user.get_picture_url(30),
+            "num_actors": noti.num_actors,
+            "seen": noti.seen,
+            "noti_date": formats.date_format(timezone.localtime(noti.noti_date), 'DATETIME_FORMAT'),
+        })
+    data = {
+        "noties": noties,
+        "next_cursor": encode_noti_cursor(noti_list[-1]) if has_next else None
+    }
+    return JsonResponse(data=data)
@@ -0,0 +1,40 @@
+from django.conf import settings
+
+from accounts.thumbnails import accepted_format
+from infos.fragment_cache import get_fragment_versions
+from posts.models import Post
+
+
+def unread_noties(request):
+    """Expose the unread notification badge once per request, read off the user's counter column."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {
+        'num_unread_noties': user.num_unread_noties
+    }
+
+
+def fragment_versions(request):
+    """Versions the {% cache %} fragments vary on, bumped by model signals when their data changes."""
+    return {
+        'fragment_versions': get_fragment_versions()
+    }
+
+
+def num_approve(request):
+    """Approval queue badge for superusers, served from the cached pending count."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_superuser:
+        return {}
+    return {
+        'num_approve': Post.get_num_pending(),
+        'approve_poll_interval_ms': settings.APPROVE_POLL_INTERVAL * 1000
+    }
+
+
+def picture_format(request):
+    """Extension of the profile picture variants this browser gets, WebP when it says it takes them."""
+    return {
+        'picture_format': accepted_format(request.META.get('HTTP_ACCEPT', ''))
+    }
@@ -0,0 +1,148 @@
+import cProfile
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends import utils as backend_utils
+from django.template import base as template_base
+
+logger = logging.getLogger('final_project.requests')
+
+# parameters are %s already, inlined numbers and quoted strings become ?, so the same query with
+# other values counts as a duplicate
+FINGERPRINT_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+IN_LIST_RE = re.compile(r'IN \((?:(?:\?|%s), )*(?:\?|%s)\)')
+# the column list says little and hides the part after it in the log
+SELECT_COLUMNS_RE = re.compile(r'^SELECT (?:DISTINCT )?.*? FROM ', re.DOTALL)
+
+_request_stats = threading.local()
+
+
+def fingerprint(sql):
+    sql = SELECT_COLUMNS_RE.sub('SELECT ... FROM ', sql, count=1)
+    return IN_LIST_RE.sub('IN (...)', FINGERPRINT_RE.sub('?', sql))
+
+
+def _timed_execute(execute):
+    """Add the query and its time to the stats of the running request."""
+    def timed_execute(self, sql, *args, **kwargs):
+        stats = getattr(_request_stats, 'current', None)
+        if stats is None:
+            return execute(self, sql, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return execute(self, sql, *args, **kwargs)
+        finally:
+            stats['queries'].append((sql, time.perf_counter() - started))
+
+    timed_execute.is_timed = True
+    return timed_execute
+
+
+def _timed_template_render(render):
+    """Add the time of the outermost template render to the stats of the running request."""
+    def timed_render(self, context):
+        stats = getattr(_request_stats, 'current', None)
+        if stats is None:
+            return render(self, context)
+        # includes and extends render templates inside this one
+        stats['template_depth'] += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            stats['template_depth'] -= 1
+            if not stats['template_depth']:
+                stats['template_time'] += time.perf_counter() - started
+
+    timed_render.is_timed = True
+    return timed_render
+
+
+class RequestStatsMiddleware:
+    """
+    Measure every request: number and time of its SQL queries, the queries it repeats, template
+    render time and the rest of the view's time (both include the SQL they run). They go to the
+    final_project.requests log as JSON and, for staff or with DEBUG, to the Server-Timing
+    header. With REQUEST_PROFILE_DIR set every request is profiled and the ones slower than
+    REQUEST_PROFILE_THRESHOLD_MS are dumped there for pstats / snakeviz.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_STATS:
+            # the patches below stay out too
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        # the debug cursor of DEBUG also goes through these
+        for name in ('execute', 'executemany'):
+            execute = getattr(backend_utils.CursorWrapper, name)
+            if not getattr(execute, 'is_timed', False):
+                setattr(backend_utils.CursorWrapper, name, _timed_execute(execute))
+        if not getattr(template_base.Template._render, 'is_timed', False):
+            template_base.Template._render = _timed_template_render(template_base.Template._render)
+
+    def __call__(self, request):
+        if not settings.REQUEST_STATS:
+            return self.get_response(request)
+
+        _request_stats.current = stats = {'queries': [], 'template_depth': 0, 'template_time': 0.0}
+        profiler = cProfile.Profile() if settings.REQUEST_PROFILE_DIR else None
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                response = profiler.runcall(self.get_response, request)
+            else:
+                response = self.get_response(request)
+        finally:
+            total_time = time.perf_counter() - started
+            _request_stats.current = None
+
+        queries = stats['queries']
+        sql_time = sum(duration for _, duration in queries)
+        template_time = stats['template_time']
+        duplicates = [
+            {'sql': sql[:300], 'count': count}
+            for sql, count in Counter(fingerprint(sql) for sql, _ in queries).most_common(5)
+            if count > 1
+        ]
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total_time * 1000, 1),
+            'view_ms': round((total_time - template_time) * 1000, 1),
+            'template_ms': round(template_time * 1000, 1),
+            'sql_ms': round(sql_time * 1000, 1),
+            'num_queries': len(queries),
+            'duplicate_queries': duplicates,
+        }
+        level = logging.WARNING if total_time * 1000 >= settings.REQUEST_SLOW_MS else logging.INFO
+        logger.log(level, json.dumps(record))
+
+        # shows how the site works inside, not for everyone
+        user = getattr(request, 'user', None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            response['Server-Timing'] = ', '.join([
+                'sql;dur={};desc="{} queries"'.format(record['sql_ms'], record['num_queries']),
+                'template;dur={}'.format(record['template_ms']),
+                'view;dur={}'.format(record['view_ms']),
+                'total;dur={}'.format(record['total_ms']),
+            ])
+
+        if profiler is not None and total_time * 1000 >= settings.REQUEST_PROFILE_THRESHOLD_MS:
+            self.dump_profile(profiler, request, total_time)
+        return response
+
+    def dump_profile(self, profiler, request, total_time):
+        os.makedirs(settings.REQUEST_PROFILE_DIR, exist_ok=True)
+        path_slug = re.sub(r'[^\w-]+', '_', request.path).strip('_') or 'root'
+        file_name = '{}_{}_{}_{}ms.prof'.format(
+            time.strftime('%Y%m%d-%H%M%S'), request.method, path_slug[:60], int(total_time * 1000)
+        )
+        profiler.dump_stats(os.path.join(settings.REQUEST_PROFILE_DIR, file_name))
@@ -0,0 +1,184 @@
+import base64
+import binascii
+import json
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+# numbered page links shown on each side of the current page
+PAGE_LINKS_AROUND = 3
+
+
+class CursorPage:
+    """A page of a CursorPaginator, iterated like a Paginator page."""
+
+    def __init__(self, object_list, paginator, number, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        # only set when the page was opened by its number
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    @cached_property
+    def page_range(self):
+        """
+        The page numbers to link: the first and last pages and those around this one (the first
+        pages when it was opened by a cursor), None standing for a gap.
+        """
+        num_pages = self.paginator.num_pages
+        if num_pages is None:
+            return []
+        current = self.number or 1
+        around = range(max(1, current - PAGE_LINKS_AROUND), min(num_pages, current + PAGE_LINKS_AROUND) + 1)
+        numbers = [1, num_pages] + list(around)
+        page_range = []
+        for number in sorted(set(numbers)):
+            if page_range and number > page_range[-1] + 1:
+                page_range.append(None)
+            page_range.append(number)
+        return page_range
+
+    @cached_property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.encode_cursor('next', self.object_list[-1])
+
+    @cached_property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.encode_cursor('prev', self.object_list[0])
+
+
+class CursorPaginator:
+    """
+    Keyset pagination: a page is the per_page rows after (or before) the last row seen, found
+    through the index on the ordering instead of an OFFSET, and nothing has to be counted.
+    ordering must be unique, e.g. ('-created_at', '-id').
+
+    A page can still be opened by its number for the numbered page links. Their total comes from
+    count, cached under count_cache_key for CURSOR_PAGINATION_COUNT_TIMEOUT seconds, and is left
+    out altogether when CURSOR_PAGINATION_PAGE_NUMBERS is off.
+    """
+
+    def __init__(self, object_list, per_page, ordering, count_cache_key=None):
+        self.object_list = object_list.order_by(*ordering)
+        self.per_page = per_page
+        self.ordering = ordering
+        self.count_cache_key = count_cache_key
+
+    @cached_property
+    def count(self):
+        if self.count_cache_key is None:
+            return self.object_list.count()
+        count = cache.get(self.count_cache_key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(self.count_cache_key, count, settings.CURSOR_PAGINATION_COUNT_TIMEOUT)
+        return count
+
+    @cached_property
+    def num_pages(self):
+        if not settings.CURSOR_PAGINATION_PAGE_NUMBERS:
+            return None
+        return max(1, int(math.ceil(self.count / self.per_page)))
+
+    @property
+    def page_range(self):
+        return range(1, (self.num_pages or 0) + 1)
+
+    def get_fields(self):
+        """(field, descending) per ordering column."""
+        model = self.object_list.model
+        return [(model._meta.get_field(name.lstrip('-')), name.startswith('-')) for name in self.ordering]
+
+    def encode_cursor(self, direction, obj):
+        values = []
+        for field, _ in self.get_fields():
+            value = getattr(obj, field.attname)
+            if isinstance(field, models.DateTimeField):
+                value = value.isoformat()
+            values.append(value)
+        cursor = json.dumps([direction] + values)
+        return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        """(direction, values) or None for a cursor that was tampered with."""
+        try:
+            direction, *values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        except (binascii.Error, UnicodeError, ValueError, TypeError):
+            return None
+        fields = self.get_fields()
+        if direction not in ('next', 'prev') or len(values) != len(fields):
+            return None
+        for i, (field, _) in enumerate(fields):
+            if isinstance(field, models.DateTimeField):
+                try:
+                    values[i] = parse_datetime(values[i]) if isinstance(values[i], str) else None
+                except ValueError:
+                    # well formed but impossible, e.g. a 31st of February
+                    return None
+            elif not isinstance(values[i], int):
+                return None
+            if values[i] is None:
+                return None
+        return direction, values
+
+    def seek_filter(self, values, backwards):
+        """Rows after values in the ordering, or before them when going backwards."""
+        seek = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.get_fields(), values):
+            lookup = 'lt' if descending != backwards else 'gt'
+            seek |= equal & Q(**{'{}__{}'.format(field.name, lookup): value})
+            equal &= Q(**{field.name: value})
+        return seek
+
+    def page(self, cursor=None, number=None):
+        position = self.decode_cursor(cursor) if cursor else None
+        if position is not None:
+            direction, values = position
+            backwards = direction == 'prev'
+            rows = self.object_list.filter(self.seek_filter(values, backwards))
+            if backwards:
+                rows = rows.reverse()
+            rows = list(rows[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            if backwards:
+                rows.reverse()
+                return CursorPage(rows, self, None, has_next=True, has_previous=has_more)
+            return CursorPage(rows, self, None, has_next=has_more, has_previous=True)
+
+        try:
+            number = max(1, int(number))
+        except (TypeError, ValueError):
+            number = 1
+        if number > 1 and self.num_pages is not None:
+            number = min(number, self.num_pages)
+        offset = (number - 1) * self.per_page
+        rows = list(self.object_list[offset:offset + self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        return CursorPage(rows[:self.per_page], self, number, has_next=has_next, has_previous=number > 1)
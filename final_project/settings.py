@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 
 import os
 
+from final_project.db import database_from_env
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
@@ -45,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'final_project.middleware.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,6 +70,10 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'final_project.context_processors.unread_noties',
+                'final_project.context_processors.fragment_versions',
+                'final_project.context_processors.num_approve',
+                'final_project.context_processors.picture_format',
             ],
         },
     },
@@ -78,10 +85,38 @@ WSGI_APPLICATION = 'final_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
+# Set with DATABASE_URL and the other variables described in final_project.db, SQLite in
+# db.sqlite3 by default. SQLite takes one writer at a time, run on a server database (PostgreSQL)
+# when several workers write.
+
 DATABASES = {
+    'default': database_from_env(os.path.join(BASE_DIR, 'db.sqlite3')),
+}
+
+# SQLITE_JOURNAL_MODE=WAL lets reads go on while a write commits. The journal mode is stored in
+# the database file, so it is opt-in: the db.sqlite3 of the repository stays in rollback mode.
+# Use it next to a looping worker (send_queued_emails, regroup_comment_noties): in rollback mode a
+# transaction that reads before it writes fails at once, without busy_timeout, when another writes
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'DELETE').upper()
+
+# run on every new SQLite connection, in this order: wait up to busy_timeout ms for the write lock,
+# set the journal mode and, under WAL only, sync to disk at checkpoints only, which WAL keeps safe
+# against corruption (a power cut may lose the last commits)
+SQLITE_PRAGMAS = (
+    ('busy_timeout', 5000),
+    ('journal_mode', SQLITE_JOURNAL_MODE),
+    ('synchronous', 'NORMAL' if SQLITE_JOURNAL_MODE == 'WAL' else 'FULL'),
+)
+
+
+# Cache
+# The template fragment versions and the count of posts waiting for approval live here, use a
+# shared backend (memcached, redis) when running more than one process or the processes will not
+# see each other's invalidations.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -129,11 +164,60 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# the tests store their files in a temporary MEDIA_ROOT
+TEST_RUNNER = 'final_project.test_runner.TempMediaTestRunner'
+
 LOGIN_REDIRECT_URL = "/"
 LOGOUT_REDIRECT_URL = "thanks"
 
 AUTH_USER_MODEL = 'accounts.User'
 
+# seconds between two reads of the cached approval count by the pages of superusers
+APPROVE_POLL_INTERVAL = 30
+
+# comment notifications of posts with at least this many comments are queued with the comment and
+# grouped by the regroup_comment_noties command (run it with --loop), None keeps them inside the request
+COMMENT_NOTI_BACKGROUND_MIN_COMMENTS = None
+
+# answer the facet part of post searches from bitmaps held in each process (posts.matching),
+# searches run in SQL while the bitmaps are loading
+POST_MATCH_INDEX = True
+
+# lists paged by final_project.pagination.CursorPaginator show numbered page links next to the
+# previous/next ones; their total is a count cached for CURSOR_PAGINATION_COUNT_TIMEOUT seconds
+CURSOR_PAGINATION_PAGE_NUMBERS = True
+CURSOR_PAGINATION_COUNT_TIMEOUT = 300
+
+# final_project.middleware.RequestStatsMiddleware logs the queries and timings of every request
+# to final_project.requests, as a warning from REQUEST_SLOW_MS on, the others at INFO which the
+# logger below leaves out (set it to INFO to see every request). With REQUEST_PROFILE_DIR set
+# every request is profiled and the ones slower than REQUEST_PROFILE_THRESHOLD_MS are dumped there.
+# Staff and DEBUG also get the timings in a Server-Timing header, False takes the middleware out
+REQUEST_STATS = True
+REQUEST_SLOW_MS = 500
+REQUEST_PROFILE_DIR = None
+REQUEST_PROFILE_THRESHOLD_MS = 1000
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'final_project.requests': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+# prune_noties deletes seen notifications older than this many days
+NOTI_RETENTION_DAYS = 90
+
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_USE_TLS = True
 EMAIL_HOST = 'smtp.gmail.com'
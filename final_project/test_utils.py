@@ -0,0 +1,8 @@
+from django.db import connection
+
+
+def explain(sql, params=()):
+    """The detail lines of SQLite's EXPLAIN QUERY PLAN for sql."""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
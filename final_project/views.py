@@ -1,9 +1,11 @@
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db.models import Count
 from django.shortcuts import redirect, render
 
 from accounts.models import User
+from infos.fragment_cache import get_fragment_versions
 from infos.models import District
 from posts.models import Post
+from .pagination import CursorPaginator
 
 POSTS_PER_PAGE = 4
 
@@ -15,37 +17,37 @@ def home_page_view(request):
             is_approved=True,
             author__is_tutor=False,
             author__is_superuser=False
-        ).order_by('-created_at').all()
+        )
     elif filter == 'tutor':
         post_lists = Post.objects.filter(
             is_approved=True,
             author__is_tutor=True
-        ).order_by('-created_at').all()
+        )
     else:
         filter = 'all'
-        post_lists = Post.objects.filter(is_approved=True).order_by('-created_at').all()
+        post_lists = Post.objects.filter(is_approved=True)
+    post_lists = post_lists.select_related('author', 'district', 'subject', 'class_level')
+    sort = request.GET.get('sort')
+    if sort == 'popular':
+        ordering = ('-like_count', '-created_at', '-id')
+    else:
+        sort = 'recent'
+        ordering = ('-created_at', '-id')
 
-    paginator = Paginator(post_lists, POSTS_PER_PAGE)
-    page = request.GET.get('page')
-    try:
-        post_list = paginator.page(page)
-    except PageNotAnInteger:
-        post_list = paginator.page(1)
-    except EmptyPage:
-        post_list = paginator.page(paginator.num_pages)
-    like_dict = {}
-    for post in post_list:
-        is_liked = post.likes.filter(username=request.user.username).exists()
-        like_dict.update({post.id: is_liked})
+    # the count is only read for the page numbers, and kept until a post changes
+    count_cache_key = 'home_posts_count:{}:{}'.format(filter, get_fragment_versions()['post_facets'])
+    paginator = CursorPaginator(post_lists, POSTS_PER_PAGE, ordering, count_cache_key=count_cache_key)
+    post_list = paginator.page(cursor=request.GET.get('cursor'), number=request.GET.get('page'))
+    Post.attach_list_stats(post_list, request.user)
     query = '&'.join(
-        '{}={}'.format(key, value) for key, value in request.GET.items() if key != 'page'
+        '{}={}'.format(key, value) for key, value in request.GET.items() if key not in ('page', 'cursor')
     )
     context = {
         'post_list': post_list,
         'paginator': paginator,
-        'like_dict': like_dict,
         'query': query,
-        'filter_check': filter
+        'filter_check': filter,
+        'sort': sort
     }
     return render(request, 'index.html', context)
 
@@ -71,17 +73,23 @@ def district_user_list_view(request, district_id):
     else:
         user_lists = User.objects.filter(district=district).all()
 
-    paginator = Paginator(user_lists, USERS_PER_PAGE)
-    page = request.GET.get('page')
-    try:
-        user_list = paginator.page(page)
-    except PageNotAnInteger:
-        user_list = paginator.page(1)
-    except EmptyPage:
-        user_list = paginator.page(paginator.num_pages)
+    # the cards show the tutors' ratings
+    user_lists = user_lists.select_related('rating_summary')
+    # user saves bump the sidebar version
+    count_cache_key = 'district_users_count:{}:{}:{}'.format(
+        district.id, filter, get_fragment_versions()['sidebar']
+    )
+    paginator = CursorPaginator(user_lists, USERS_PER_PAGE, ('id',), count_cache_key=count_cache_key)
+    user_list = paginator.page(cursor=request.GET.get('cursor'), number=request.GET.get('page'))
+    # and the number of posts of everyone on the page, counted at once
+    num_posts = dict(Post.objects.filter(
+        author_id__in=[user.id for user in user_list]
+    ).order_by().values_list('author_id').annotate(num=Count('id')))
+    for user in user_list:
+        user.num_posts = num_posts.get(user.id, 0)
 
     query = '&'.join(
-        '{}={}'.format(key, value) for key, value in request.GET.items() if key != 'page'
+        '{}={}'.format(key, value) for key, value in request.GET.items() if key not in ('page', 'cursor')
     )
     context = {
         'user_list': user_list,
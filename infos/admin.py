@@ -1,10 +1,18 @@
 from django.contrib import admin
 
-from infos.models import School, Subject, ClassLevel, District, Rating, Notify
+from infos.models import School, Subject, ClassLevel, District, Rating, Notify, RatingSummary, CommentNotiJob
 
 admin.site.register(School)
 admin.site.register(Subject)
 admin.site.register(ClassLevel)
 admin.site.register(District)
 admin.site.register(Rating)
+admin.site.register(RatingSummary)
 admin.site.register(Notify)
+
+
+class CommentNotiJobAdmin(admin.ModelAdmin):
+    list_display = ('post', 'new_actor', 'num_attempts', 'next_attempt_at')
+
+
+admin.site.register(CommentNotiJob, CommentNotiJobAdmin)
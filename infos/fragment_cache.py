@@ -0,0 +1,35 @@
+import time
+
+from django.core.cache import cache
+
+# bumping a version changes the key of every {% cache %} fragment that varies on it, so the old
+# fragments are never read again and simply expire
+FRAGMENT_VERSION_KEYS = {
+    'sidebar': 'fragment_version:sidebar',
+    'post_card': 'fragment_version:post_card',
+    # not a template fragment: the cached facet counts of the post search
+    'post_facets': 'fragment_version:post_facets',
+}
+
+
+def get_fragment_versions():
+    versions = cache.get_many(list(FRAGMENT_VERSION_KEYS.values()))
+    fragment_versions = {}
+    for name, key in FRAGMENT_VERSION_KEYS.items():
+        if key not in versions:
+            # start from the clock rather than 0 so an evicted version never reuses an old key
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+        fragment_versions[name] = versions[key]
+    return fragment_versions
+
+
+def bump_fragment_version(name):
+    """Returns the new version."""
+    key = FRAGMENT_VERSION_KEYS[name]
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(key, version, None)
+        return version
@@ -0,0 +1,73 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import User
+from infos.management.commands.benchmark_pages import percentile
+from infos.models import RatingSummary
+
+LEADERBOARD_TEMPLATE = '{% load my_template_tags %}{% show_rating_list 5 %}'
+
+
+class Command(BaseCommand):
+    help = ('Render the top tutor leaderboard with more and more tutors and report p50/p95 latency '
+            'and queries per size. The tutors are added in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                            help='Numbers of tutors to time the leaderboard at.')
+        parser.add_argument('--requests', type=int, default=50, help='Timed renders per size.')
+        parser.add_argument('--unrated-share', type=float, default=0.2,
+                            help='Share of the added tutors without any rating.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1.')
+        rng = random.Random(options['seed'])
+        template = Template(LEADERBOARD_TEMPLATE)
+        # hashing is slow on purpose, every tutor gets the same one
+        password = make_password(None)
+        with transaction.atomic():
+            num_tutors = User.objects.filter(is_tutor=True).count()
+            for size in sorted(options['sizes']):
+                if size > num_tutors:
+                    self.add_tutors(size - num_tutors, password, rng, options)
+                    num_tutors = size
+                times = []
+                num_queries = []
+                for _ in range(options['requests']):
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        template.render(Context({}))
+                        times.append(time.perf_counter() - started)
+                    num_queries.append(len(queries))
+                times.sort()
+                self.stdout.write('{:>8} tutors  p50 {:>7.2f} ms  p95 {:>7.2f} ms  {} queries'.format(
+                    num_tutors, percentile(times, 50) * 1000, percentile(times, 95) * 1000, max(num_queries)))
+            transaction.set_rollback(True)
+
+    def add_tutors(self, number, password, rng, options):
+        last_id = User.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        User.objects.bulk_create(
+            (User(username='leaderboard{}'.format(last_id + i), password=password, is_tutor=True, is_active=True)
+             for i in range(1, number + 1)),
+            batch_size=options['batch_size']
+        )
+        summaries = []
+        for user_id in User.objects.filter(id__gt=last_id).values_list('id', flat=True):
+            if rng.random() < options['unrated_share']:
+                continue
+            num_raters = rng.randint(1, 50)
+            summary = RatingSummary(user_id=user_id, num_raters=num_raters,
+                                    rating_sum=sum(rng.randint(1, 5) for _ in range(num_raters)))
+            summary.avg_rating = summary.compute_avg()
+            summaries.append(summary)
+        RatingSummary.objects.bulk_create(summaries, batch_size=options['batch_size'])
@@ -0,0 +1,242 @@
+import json
+import logging
+import math
+import os
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from accounts.models import User
+from infos.models import District, RatingSummary
+from posts.models import Comment, ModerationBatch, Post
+
+DEFAULT_OUTPUT = os.path.join(settings.BASE_DIR, 'benchmark_results.jsonl')
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, int(math.ceil(percent / 100 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def get_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                        cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+    return commit + ('+dirty' if dirty else '')
+
+
+class Command(BaseCommand):
+    help = ('Request the main pages with the test client and report p50/p95 latency and queries per '
+            'page, along with the leaderboard and post moderation. Results are appended to a file '
+            'and compared with an earlier run. Fill the database with generate_dataset first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per page.')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per page first.')
+        parser.add_argument('--username', default=None,
+                            help='Log in as this user, by default the first active student.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the cache before every request.')
+        parser.add_argument('--moderation-batch', type=int, default=100,
+                            help='Pending posts approved per timed moderation, rolled back after.')
+        parser.add_argument('--output', default=DEFAULT_OUTPUT)
+        parser.add_argument('--label', default='', help='Name of this run in the results file.')
+        parser.add_argument('--compare', default=None,
+                            help='Label or commit of the run to compare with, the previous one by default.')
+        parser.add_argument('--no-save', action='store_true')
+
+    def handle(self, *args, **options):
+        self.num_requests = options['requests']
+        self.warmup = options['warmup']
+        self.cold = options['cold']
+        if self.num_requests < 1:
+            raise CommandError('--requests must be at least 1.')
+
+        user_qs = User.objects.filter(is_active=True, is_superuser=False)
+        if options['username']:
+            user_qs = User.objects.filter(username=options['username'])
+        user = user_qs.filter(is_tutor=False).first() or user_qs.first()
+        if user is None:
+            raise CommandError('No user to log in as, run generate_dataset first.')
+
+        # the test client's host and the per-request log of the middleware
+        setup_test_environment()
+        request_logger = logging.getLogger('final_project.requests')
+        request_logger_disabled = request_logger.disabled
+        request_logger.disabled = True
+        try:
+            client = Client()
+            client.force_login(user)
+            pages = {}
+            for name, url in self.get_urls():
+                pages[name] = self.time_page(client, url)
+                self.write_row(name, pages[name])
+            operations = {}
+            for name, func in (('leaderboard', self.time_leaderboard),
+                               ('moderation', lambda: self.time_moderation(options['moderation_batch']))):
+                operations[name] = func()
+                if operations[name] is not None:
+                    self.write_row(name, operations[name])
+        finally:
+            request_logger.disabled = request_logger_disabled
+            teardown_test_environment()
+
+        run = {
+            'label': options['label'],
+            'commit': get_commit(),
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'dataset': {
+                'users': User.objects.count(),
+                'posts': Post.objects.count(),
+                'comments': Comment.objects.count(),
+                'likes': Post.likes.through.objects.count(),
+            },
+            'requests': self.num_requests,
+            'cold': self.cold,
+            'pages': pages,
+            'operations': operations,
+        }
+        previous = self.find_run(options['output'], options['compare'])
+        if previous is not None:
+            self.write_comparison(previous, run)
+        elif options['compare']:
+            self.stderr.write('No run {} in {}.'.format(options['compare'], options['output']))
+        if not options['no_save']:
+            with open(options['output'], 'a') as results:
+                results.write(json.dumps(run) + '\n')
+            self.stdout.write('Saved to {}.'.format(options['output']))
+
+    def get_urls(self):
+        """The pages to time, on the busiest rows so they show the worst case."""
+        urls = [
+            ('index', reverse('index')),
+            ('index_popular', reverse('index') + '?sort=popular'),
+            ('index_page_10', reverse('index') + '?page=10'),
+        ]
+        post = Post.objects.filter(is_approved=True).order_by('-like_count').first()
+        if post is not None:
+            urls.append(('search_facets', '{}?district={}&subject={}&class_level={}'.format(
+                reverse('posts:search_post'), post.district_id or '', post.subject_id or '',
+                post.class_level_id or '')))
+            urls.append(('search_keywords', '{}?keywords={}'.format(
+                reverse('posts:search_post'), '+'.join(post.title.split()[:2]))))
+            urls.append(('detail_post', reverse('posts:detail_post', kwargs={'pk': post.id})))
+        summary = RatingSummary.objects.order_by('-num_raters').first()
+        if summary is not None:
+            urls.append(('profile', reverse('accounts:profile', kwargs={'pk': summary.user_id})))
+        district = District.objects.annotate(num_users=Count('district_users')).order_by('-num_users').first()
+        if district is not None:
+            urls.append(('district_user', reverse('district_user', kwargs={'district_id': district.id})))
+        return urls
+
+    def time_page(self, client, url):
+        for _ in range(self.warmup):
+            client.get(url)
+        times = []
+        num_queries = []
+        statuses = set()
+        for _ in range(self.num_requests):
+            if self.cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url)
+                times.append(time.perf_counter() - started)
+            num_queries.append(len(queries))
+            statuses.add(response.status_code)
+        return self.summarize(times, num_queries, url=url, status=sorted(statuses))
+
+    def time_leaderboard(self):
+        times = []
+        num_queries = []
+        for _ in range(self.num_requests):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                RatingSummary.top_tutors(5)
+                times.append(time.perf_counter() - started)
+            num_queries.append(len(queries))
+        return self.summarize(times, num_queries)
+
+    def time_moderation(self, batch_size):
+        """Approve batches of pending posts, each rolled back so every run finds the same posts."""
+        moderator = User.objects.filter(is_superuser=True).first()
+        pending_ids = list(Post.objects.filter(is_approved=False).values_list('id', flat=True)[:batch_size])
+        if moderator is None or not pending_ids:
+            self.stderr.write('Skipping moderation, it needs a superuser and pending posts.')
+            return None
+        times = []
+        num_queries = []
+        for _ in range(self.num_requests):
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    ModerationBatch.moderate(moderator, Post.objects.filter(id__in=pending_ids),
+                                             ModerationBatch.APPROVE)
+                    times.append(time.perf_counter() - started)
+                num_queries.append(len(queries))
+                transaction.set_rollback(True)
+        result = self.summarize(times, num_queries)
+        if result['p50_ms']:
+            result['posts_per_second'] = round(len(pending_ids) / result['p50_ms'] * 1000, 1)
+        return result
+
+    def summarize(self, times, num_queries, **extra):
+        times.sort()
+        result = {
+            'p50_ms': round(percentile(times, 50) * 1000, 2),
+            'p95_ms': round(percentile(times, 95) * 1000, 2),
+            'queries': max(num_queries),
+        }
+        result.update(extra)
+        return result
+
+    def write_row(self, name, result):
+        status = result.get('status')
+        self.stdout.write('{:<16} p50 {:>8.2f} ms  p95 {:>8.2f} ms  {:>3} queries{}'.format(
+            name, result['p50_ms'], result['p95_ms'], result['queries'],
+            '  status {}'.format(status) if status and status != [200] else ''))
+
+    def find_run(self, path, label):
+        if not os.path.exists(path):
+            return None
+        with open(path) as results:
+            runs = [json.loads(line) for line in results if line.strip()]
+        if label is None:
+            return runs[-1] if runs else None
+        for run in reversed(runs):
+            if label in (run['label'], run['commit']) or run['commit'].startswith(label):
+                return run
+        return None
+
+    def write_comparison(self, previous, run):
+        self.stdout.write('\nCompared with {} ({}, {}):'.format(
+            previous['label'] or previous['commit'] or 'the previous run', previous['commit'],
+            previous['created_at']))
+        if previous['dataset'] != run['dataset']:
+            self.stdout.write('  the dataset differs: {} then, {} now'.format(previous['dataset'], run['dataset']))
+        if previous['cold'] != run['cold']:
+            self.stdout.write('  only one of the runs cleared the cache before every request')
+        for group in ('pages', 'operations'):
+            for name, result in run[group].items():
+                before = previous.get(group, {}).get(name)
+                if not before or result is None:
+                    continue
+                change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+                line = '{:<16} p50 {:>8.2f} -> {:>8.2f} ms ({:+.0f}%)  queries {} -> {}'.format(
+                    name, before['p50_ms'], result['p50_ms'], change, before['queries'], result['queries'])
+                self.stdout.write(self.style.WARNING(line) if change > 10 else line)
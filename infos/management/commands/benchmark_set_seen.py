@@ -0,0 +1,80 @@
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import User
+from infos.management.commands.benchmark_pages import percentile
+from infos.models import Notify
+
+
+class Command(BaseCommand):
+    help = ('Time Notify.set_seen for a user with a longer and longer notification history and '
+            'report p50/p95 latency and queries per size. The history is added in a transaction '
+            'that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000],
+                            help='Seen notifications of the user to time set_seen at.')
+        parser.add_argument('--unseen', type=int, default=5,
+                            help='New notifications marked seen by each timed call.')
+        parser.add_argument('--requests', type=int, default=20, help='Timed calls per size.')
+        parser.add_argument('--username', default=None, help='By default the first active user.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1.')
+        user_qs = User.objects.filter(is_active=True)
+        if options['username']:
+            user_qs = User.objects.filter(username=options['username'])
+        users = list(user_qs.order_by('id')[:2])
+        if not users:
+            raise CommandError('No user to notify, run generate_dataset first.')
+        user, from_user = users[0], users[-1]
+        rng = random.Random(options['seed'])
+        self.now = timezone.now()
+
+        with transaction.atomic():
+            history = Notify.objects.filter(to_user=user).count()
+            for size in sorted(options['sizes']):
+                if size > history:
+                    # rating notifications have no post, any number of them fits the unique constraint
+                    self.add_noties(user, from_user, size - history, True, rng, options['batch_size'])
+                    history = size
+                times = []
+                num_queries = []
+                for _ in range(options['requests']):
+                    self.add_noties(user, from_user, options['unseen'], False, rng, options['batch_size'])
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        Notify.set_seen(user)
+                        times.append(time.perf_counter() - started)
+                    num_queries.append(len(queries))
+                    history += options['unseen']
+                times.sort()
+                self.stdout.write('{:>8} noties  p50 {:>7.2f} ms  p95 {:>7.2f} ms  {} queries'.format(
+                    history, percentile(times, 50) * 1000, percentile(times, 95) * 1000, max(num_queries)))
+            transaction.set_rollback(True)
+
+    def add_noties(self, user, from_user, number, seen, rng, batch_size):
+        # spread over the retention period, like a history prune_noties keeps
+        max_age = settings.NOTI_RETENTION_DAYS * 24 * 3600
+        Notify.objects.bulk_create((
+            Notify(
+                from_user=from_user,
+                to_user=user,
+                noti_type=Notify.RATING,
+                rating=rng.randint(1, 5),
+                seen=seen,
+                noti_date=self.now - timedelta(seconds=rng.randint(0, max_age)) if seen else timezone.now()
+            ) for _ in range(number)
+        ), batch_size=batch_size)
+        if not seen:
+            Notify.add_unread({user.id: number})
@@ -0,0 +1,269 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Max, Value, When
+from django.utils import timezone
+
+from accounts.models import User
+from infos.fragment_cache import FRAGMENT_VERSION_KEYS, bump_fragment_version
+from infos.models import ClassLevel, District, Notify, Rating, RatingSummary, Subject
+from posts.models import Comment, Post
+from posts.search import rebuild_index
+
+WORDS = (
+    'math physics chemistry english literature biology history geography tutor student lesson '
+    'exam grade class homework online offline weekend evening morning teacher university high '
+    'school primary secondary review practice basic advanced experienced patient friendly need '
+    'looking for help prepare test skills reading writing speaking listening hanoi cau giay '
+    'dong da hai ba trung ba dinh hours week salary negotiable'
+).split()
+
+PASSWORD = 'H1111111'
+HISTORY_DAYS = 90
+
+
+class Command(BaseCommand):
+    help = ('Fill the database with generated users, posts, comments, likes, ratings and '
+            'notifications for load tests, inserted in bulk. Counters, rating summaries and the '
+            'search index are rebuilt afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--tutor-share', type=float, default=0.3,
+                            help='Share of the users that are tutors.')
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--pending-share', type=float, default=0.05,
+                            help='Share of the posts waiting for approval.')
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--likes', type=int, default=50000)
+        parser.add_argument('--ratings', type=int, default=5000)
+        parser.add_argument('--noties', type=int, default=20000)
+        parser.add_argument('--districts', type=int, default=12,
+                            help='Districts to have at least, missing ones are created.')
+        parser.add_argument('--subjects', type=int, default=10,
+                            help='Subjects to have at least, missing ones are created.')
+        parser.add_argument('--prefix', default='loadtest',
+                            help='Usernames are this prefix followed by a number, the password is '
+                                 '{}.'.format(PASSWORD))
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+
+        self.step('reference data', self.make_reference_data, options['districts'], options['subjects'])
+        self.step('users', self.make_users, options['users'], options['tutor_share'], options['prefix'])
+        self.step('posts', self.make_posts, options['posts'], options['pending_share'])
+        self.step('likes', self.make_likes, options['likes'])
+        self.step('comments', self.make_comments, options['comments'])
+        self.step('ratings', self.make_ratings, options['ratings'])
+        self.step('notifications', self.make_noties, options['noties'])
+        self.step('post counts', Post.repair_counts)
+        self.step('rating summaries', RatingSummary.rebuild)
+        self.step('unread counters', Notify.rebuild_unread)
+        self.step('search index', rebuild_index)
+        # bulk_create sends no signals
+        for name in FRAGMENT_VERSION_KEYS:
+            bump_fragment_version(name)
+
+    def step(self, name, func, *args):
+        started = time.perf_counter()
+        with transaction.atomic():
+            result = func(*args)
+        self.stdout.write('{:<18} {:>8} in {:.1f} s'.format(
+            name, result if result is not None else '', time.perf_counter() - started))
+
+    def bulk_create(self, model, objs):
+        """Insert objs and return a queryset of the new rows, SQLite doesn't set their ids on objs."""
+        last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        return model.objects.filter(id__gt=last_id).order_by('id')
+
+    def skewed_choice(self, items):
+        """Pick from items, the first ones far more often, like popular posts and active users."""
+        return items[int(len(items) * self.rng.random() ** 3)]
+
+    def random_date(self):
+        return self.now - timedelta(seconds=self.rng.randint(0, HISTORY_DAYS * 24 * 3600))
+
+    def words(self, low, high):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(low, high)))
+
+    def make_reference_data(self, num_districts, num_subjects):
+        created = 0
+        for model, number, name in ((District, num_districts, 'District {}'), (Subject, num_subjects, 'Subject {}')):
+            existing = set(model.objects.values_list('name', flat=True))
+            names = []
+            suffix = 1
+            while len(existing) + len(names) < number:
+                if name.format(suffix) not in existing:
+                    names.append(name.format(suffix))
+                suffix += 1
+            model.objects.bulk_create(model(name=value) for value in names)
+            created += len(names)
+        existing_levels = set(ClassLevel.objects.values_list('class_level', flat=True))
+        levels = [ClassLevel(class_level=level) for level in range(1, 13) if level not in existing_levels]
+        ClassLevel.objects.bulk_create(levels)
+        self.district_ids = list(District.objects.values_list('id', flat=True))
+        self.subject_ids = list(Subject.objects.values_list('id', flat=True))
+        self.class_level_ids = list(ClassLevel.objects.values_list('id', flat=True))
+        return created + len(levels)
+
+    def make_users(self, num_users, tutor_share, prefix):
+        start = User.objects.filter(username__startswith=prefix).count()
+        # hashing is slow on purpose, every user gets the same one
+        password = make_password(PASSWORD)
+        users = []
+        for number in range(start, start + num_users):
+            users.append(User(
+                username='{}{}'.format(prefix, number),
+                email='{}{}@example.com'.format(prefix, number),
+                password=password,
+                first_name='User{}'.format(number),
+                is_tutor=self.rng.random() < tutor_share,
+                district_id=self.rng.choice(self.district_ids),
+                favorite_subject_id=self.rng.choice(self.subject_ids),
+                intro_yourself=self.words(5, 30),
+                is_active=True,
+                date_joined=self.random_date()
+            ))
+        if not User.objects.filter(is_superuser=True).exists():
+            # the moderator of the approval pages and of benchmark_pages
+            users.append(User(
+                username='{}admin'.format(prefix),
+                email='{}admin@example.com'.format(prefix),
+                password=password,
+                is_superuser=True,
+                is_staff=True,
+                is_active=True,
+                date_joined=self.now
+            ))
+        user_qs = self.bulk_create(User, users)
+        self.user_ids = list(user_qs.values_list('id', flat=True))
+        self.tutor_ids = list(user_qs.filter(is_tutor=True).values_list('id', flat=True))
+        num_users = len(self.user_ids)
+        if not num_users:
+            # posts and the rest go to the users already there
+            self.user_ids = list(User.objects.values_list('id', flat=True))
+            self.tutor_ids = list(User.objects.filter(is_tutor=True).values_list('id', flat=True))
+        return num_users
+
+    def make_posts(self, num_posts, pending_share):
+        posts = []
+        for _ in range(num_posts if self.user_ids else 0):
+            posts.append(Post(
+                title=self.words(3, 10)[:100],
+                author_id=self.skewed_choice(self.user_ids),
+                district_id=self.rng.choice(self.district_ids + [None]),
+                subject_id=self.rng.choice(self.subject_ids + [None]),
+                class_level_id=self.rng.choice(self.class_level_ids + [None]),
+                salary_hour=self.rng.randrange(50000, 500000, 10000),
+                times_week=self.rng.randint(1, 5),
+                text=self.words(20, 200),
+                is_approved=self.rng.random() >= pending_share
+            ))
+        post_qs = self.bulk_create(Post, posts)
+        self.post_authors = dict(post_qs.values_list('id', 'author_id'))
+        self.post_ids = list(self.post_authors)
+        # created_at is auto_now, spread the posts over the history the way they would have come in
+        for start in range(0, len(self.post_ids), self.batch_size):
+            batch = self.post_ids[start:start + self.batch_size]
+            Post.objects.filter(id__in=batch).update(created_at=Case(
+                *[When(id=post_id, then=Value(self.random_date())) for post_id in batch],
+                output_field=DateTimeField()
+            ))
+        return len(self.post_ids)
+
+    def random_pairs(self, number, pick):
+        """number distinct pairs from pick(), None gives up after many repeats in a row."""
+        pairs = set()
+        misses = 0
+        while len(pairs) < number and misses < 1000:
+            pair = pick()
+            if pair is None or pair in pairs:
+                misses += 1
+            else:
+                pairs.add(pair)
+                misses = 0
+        return pairs
+
+    def make_likes(self, num_likes):
+        self.like_pairs = set()
+        if self.post_ids and self.user_ids:
+            self.like_pairs = self.random_pairs(
+                num_likes, lambda: (self.skewed_choice(self.post_ids), self.rng.choice(self.user_ids))
+            )
+        like_model = Post.likes.through
+        like_model.objects.bulk_create(
+            (like_model(post_id=post_id, user_id=user_id) for post_id, user_id in self.like_pairs),
+            batch_size=self.batch_size
+        )
+        return len(self.like_pairs)
+
+    def make_comments(self, num_comments):
+        comments = []
+        if self.post_ids and self.user_ids:
+            for _ in range(num_comments):
+                comments.append(Comment(
+                    post_id=self.skewed_choice(self.post_ids),
+                    author_id=self.rng.choice(self.user_ids),
+                    text=self.words(3, 40),
+                    created_date=self.random_date()
+                ))
+        Comment.objects.bulk_create(comments, batch_size=self.batch_size)
+        self.comment_pairs = {(comment.post_id, comment.author_id) for comment in comments}
+        return len(comments)
+
+    def make_ratings(self, num_ratings):
+        def pick():
+            from_user_id = self.rng.choice(self.user_ids)
+            to_user_id = self.skewed_choice(self.tutor_ids)
+            return (from_user_id, to_user_id) if from_user_id != to_user_id else None
+
+        pairs = self.random_pairs(num_ratings, pick) if self.tutor_ids else set()
+        ratings = [
+            Rating(from_user_id=from_user_id, to_user_id=to_user_id, rating=self.rng.randint(1, 5))
+            for from_user_id, to_user_id in pairs
+        ]
+        Rating.objects.bulk_create(ratings, batch_size=self.batch_size)
+        self.ratings = ratings
+        return len(ratings)
+
+    def make_noties(self, num_noties):
+        """Grouped like and comment notifications to the post authors and one per rating."""
+        actors = {}
+        for noti_type, pairs in ((Notify.LIKE, self.like_pairs), (Notify.COMMENT, self.comment_pairs)):
+            for post_id, user_id in pairs:
+                if user_id != self.post_authors[post_id]:
+                    actors.setdefault((noti_type, post_id), []).append(user_id)
+        candidates = [
+            (noti_type, post_id, self.post_authors[post_id], user_ids, -1)
+            for (noti_type, post_id), user_ids in actors.items()
+        ]
+        candidates.extend(
+            (Notify.RATING, None, rating.to_user_id, [rating.from_user_id], rating.rating)
+            for rating in self.ratings
+        )
+        noties = []
+        for noti_type, post_id, to_user_id, user_ids, rating in self.rng.sample(
+                candidates, min(num_noties, len(candidates))):
+            self.rng.shuffle(user_ids)
+            noties.append(Notify(
+                from_user_id=user_ids[0],
+                to_user_id=to_user_id,
+                noti_type=noti_type,
+                noti_post_id=post_id,
+                rating=rating,
+                num_actors=len(user_ids),
+                recent_actors=','.join(str(user_id) for user_id in user_ids[:Notify.RECENT_ACTORS]),
+                seen=self.rng.random() < 0.7,
+                noti_date=self.random_date()
+            ))
+        Notify.objects.bulk_create(noties, batch_size=self.batch_size)
+        return len(noties)
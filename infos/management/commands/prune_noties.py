@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from infos.models import Notify
+
+
+class Command(BaseCommand):
+    help = 'Delete seen notifications older than the retention period, in small batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.NOTI_RETENTION_DAYS,
+                            help='Keep seen notifications newer than this many days.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Seconds to sleep between batches so other writers get the lock.')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        num_deleted = Notify.delete_old_seen(
+            before,
+            batch_size=options['batch_size'],
+            pause=options['pause']
+        )
+        self.stdout.write(self.style.SUCCESS('Deleted {} notifications seen before {}.'.format(
+            num_deleted, before.date()
+        )))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from infos.models import RatingSummary
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-tutor rating summaries from the Rating table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int,
+                            help='Only repair the summaries of these users.')
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids'] or None
+        num_rows = RatingSummary.rebuild(user_ids=user_ids)
+        self.stdout.write(self.style.SUCCESS('Rebuilt {} rating summaries.'.format(num_rows)))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from infos.models import Notify
+
+
+class Command(BaseCommand):
+    help = "Reconcile every user's unread notification counter with the Notify table."
+
+    def handle(self, *args, **options):
+        num_fixed = Notify.rebuild_unread()
+        self.stdout.write(self.style.SUCCESS('Fixed {} unread counters.'.format(num_fixed)))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from infos.models import CommentNotiJob
+
+
+class Command(BaseCommand):
+    help = 'Regroup the comment notifications of the posts queued by comment_on_post.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Posts picked from the queue at once.')
+        parser.add_argument('--loop', action='store_true', dest='loop',
+                            help='Keep running, polling the queue when it is empty.')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='Seconds to wait before polling an empty queue again.')
+
+    def handle(self, *args, **options):
+        total_done = 0
+        total_failed = 0
+        while True:
+            num_done, num_failed = CommentNotiJob.run_due(batch_size=options['batch_size'])
+            total_done += num_done
+            total_failed += num_failed
+            if num_done or num_failed:
+                self.stdout.write('Regrouped {}, failed {}.'.format(num_done, num_failed))
+            if num_done + num_failed < options['batch_size']:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Regrouped the notifications of {} posts, {} attempts failed.'.format(
+            total_done, total_failed)))
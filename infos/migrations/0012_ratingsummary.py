@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:07
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_rating_summary(apps, schema_editor):
+    Rating = apps.get_model('infos', 'Rating')
+    RatingSummary = apps.get_model('infos', 'RatingSummary')
+    totals = Rating.objects.filter(to_user__isnull=False).values('to_user_id').annotate(
+        rating_sum=models.Sum('rating'),
+        num_raters=models.Count('id')
+    )
+    summaries = []
+    for row in totals:
+        rating_sum = row['rating_sum'] or 0
+        summaries.append(RatingSummary(
+            user_id=row['to_user_id'],
+            rating_sum=rating_sum,
+            num_raters=row['num_raters'],
+            avg_rating=rating_sum / max(row['num_raters'], 3)
+        ))
+    RatingSummary.objects.bulk_create(summaries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_auto_20170812_0921'),
+        ('infos', '0011_auto_20170813_1140'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('num_raters', models.IntegerField(default=0)),
+                ('avg_rating', models.FloatField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_rating_summary, migrations.RunPython.noop),
+    ]
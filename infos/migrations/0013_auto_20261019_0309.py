@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:09
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def remove_duplicate_rating_noties(Notify, from_user_id, to_user_id, rating):
+    """Keep the latest rating notification of a vote, showing the vote that was kept."""
+    noties = list(Notify.objects.filter(
+        from_user_id=from_user_id,
+        to_user_id=to_user_id,
+        noti_type='3'
+    ).order_by('-noti_date', '-id'))
+    if not noties:
+        return
+    keep = noties[0]
+    keep.rating = rating
+    keep.seen = all(noti.seen for noti in noties)
+    keep.save()
+    # the unread counters are recounted by infos 0014
+    Notify.objects.filter(id__in=[noti.id for noti in noties[1:]]).delete()
+
+
+def remove_duplicate_ratings(apps, schema_editor):
+    """
+    Keep only the latest vote per (from_user, to_user) and its latest notification, and refresh
+    the affected summaries.
+    """
+    Rating = apps.get_model('infos', 'Rating')
+    RatingSummary = apps.get_model('infos', 'RatingSummary')
+    Notify = apps.get_model('infos', 'Notify')
+    duplicates = Rating.objects.filter(
+        from_user__isnull=False,
+        to_user__isnull=False
+    ).values('from_user_id', 'to_user_id').annotate(
+        last_id=models.Max('id'),
+        num_votes=models.Count('id')
+    ).filter(num_votes__gt=1)
+    to_user_ids = set()
+    for row in duplicates:
+        Rating.objects.filter(
+            from_user_id=row['from_user_id'],
+            to_user_id=row['to_user_id']
+        ).exclude(id=row['last_id']).delete()
+        remove_duplicate_rating_noties(Notify, row['from_user_id'], row['to_user_id'],
+                                       Rating.objects.get(id=row['last_id']).rating)
+        to_user_ids.add(row['to_user_id'])
+    for to_user_id in to_user_ids:
+        totals = Rating.objects.filter(to_user_id=to_user_id).aggregate(
+            rating_sum=models.Sum('rating'),
+            num_raters=models.Count('id')
+        )
+        rating_sum = totals['rating_sum'] or 0
+        RatingSummary.objects.filter(user_id=to_user_id).update(
+            rating_sum=rating_sum,
+            num_raters=totals['num_raters'],
+            avg_rating=rating_sum / max(totals['num_raters'], 3)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('infos', '0012_ratingsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_ratings, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='rating',
+            unique_together=set([('from_user', 'to_user')]),
+        ),
+        migrations.AddIndex(
+            model_name='notify',
+            index=models.Index(fields=['to_user', 'seen'], name='notify_to_user_seen_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notify',
+            index=models.Index(fields=['to_user', '-noti_date'], name='notify_to_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:13
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def group_existing_noties(apps, schema_editor):
+    """Collapse like/comment notifications into one row per (to_user, noti_type, noti_post)."""
+    Notify = apps.get_model('infos', 'Notify')
+    User = apps.get_model('accounts', 'User')
+    noti_qs = Notify.objects.filter(
+        noti_type__in=['1', '2'],
+        to_user__isnull=False,
+        noti_post__isnull=False
+    ).order_by('to_user_id', 'noti_type', 'noti_post_id', '-noti_date', '-id')
+    group_key = None
+    group = []
+
+    def collapse(group):
+        actor_ids = []
+        for noti in group:
+            if noti.from_user_id not in actor_ids:
+                actor_ids.append(noti.from_user_id)
+        keep = group[0]
+        keep.num_actors = len(actor_ids)
+        keep.recent_actors = ','.join(str(actor_id) for actor_id in actor_ids[:3])
+        keep.seen = all(noti.seen for noti in group)
+        keep.save()
+        if len(group) > 1:
+            Notify.objects.filter(id__in=[noti.id for noti in group[1:]]).delete()
+
+    for noti in noti_qs.iterator():
+        key = (noti.to_user_id, noti.noti_type, noti.noti_post_id)
+        if key != group_key and group:
+            collapse(group)
+            group = []
+        group_key = key
+        group.append(noti)
+    if group:
+        collapse(group)
+
+    unread_counts = dict(Notify.objects.filter(
+        seen=False,
+        to_user__isnull=False
+    ).order_by().values_list('to_user_id').annotate(num=models.Count('id')))
+    User.objects.update(num_unread_noties=0)
+    for user_id, num_unread in unread_counts.items():
+        User.objects.filter(pk=user_id).update(num_unread_noties=num_unread)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0005_auto_20261019_0309'),
+        ('infos', '0013_auto_20261019_0309'),
+        ('accounts', '0010_user_num_unread_noties'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notify',
+            name='num_actors',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notify',
+            name='recent_actors',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.RunPython(group_existing_noties, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='notify',
+            unique_together=set([('to_user', 'noti_type', 'noti_post')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:14
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('infos', '0014_grouped_notify'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notify',
+            index=models.Index(fields=['seen', 'noti_date'], name='notify_seen_date_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('infos', '0015_auto_20261019_0314'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ratingsummary',
+            name='avg_rating',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='ratingsummary',
+            index=models.Index(fields=['-avg_rating', 'user'], name='rating_summary_rank_idx'),
+        ),
+    ]
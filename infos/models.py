@@ -1,7 +1,14 @@
+import time
+from datetime import timedelta
+
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
+from .fragment_cache import bump_fragment_version
+
 
 class School(models.Model):
     name = models.CharField(max_length=50, unique=True, null=True, blank=True)
@@ -36,6 +43,98 @@ class Rating(models.Model):
     to_user = models.ForeignKey('accounts.User', null=True, related_name="+")
     rating = models.IntegerField(validators=[MaxValueValidator(5), MinValueValidator(0)], null=True, blank=True)
 
+    class Meta:
+        unique_together = ('from_user', 'to_user')
+
+
+class RatingSummary(models.Model):
+    # tutors with fewer raters than this are averaged as if the missing votes were 0 stars
+    MIN_RATERS = 3
+
+    user = models.OneToOneField('accounts.User', primary_key=True, related_name='rating_summary')
+    rating_sum = models.IntegerField(default=0)
+    num_raters = models.IntegerField(default=0)
+    avg_rating = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            # the leaderboard order, ties go to the older account
+            models.Index(fields=['-avg_rating', 'user'], name='rating_summary_rank_idx'),
+        ]
+
+    def __str__(self):
+        return "{} {:03.2f} ({})".format(self.user_id, self.avg_rating, self.num_raters)
+
+    def compute_avg(self):
+        if self.num_raters == 0:
+            return 0
+        return self.rating_sum / max(self.num_raters, self.MIN_RATERS)
+
+    @classmethod
+    def apply_vote(cls, to_user, new_rating, old_rating=None):
+        """Fold one vote into the tutor's summary; old_rating is set when a vote is changed."""
+        with transaction.atomic():
+            summary, created = cls.objects.select_for_update().get_or_create(user=to_user)
+            summary.rating_sum += new_rating - (old_rating or 0)
+            if old_rating is None:
+                summary.num_raters += 1
+            summary.avg_rating = summary.compute_avg()
+            summary.save()
+        return summary
+
+    @classmethod
+    def top_tutors(cls, number_result):
+        """Best rated tutors, read straight off the rank index."""
+        # tutors are picked out here and not with a join filter: given is_tutor to filter on,
+        # SQLite starts from the users and sorts every summary instead of walking the index
+        summaries = cls.objects.select_related('user').order_by('-avg_rating', 'user_id')
+        top_list = []
+        start = 0
+        while len(top_list) < number_result:
+            chunk = list(summaries[start:start + number_result])
+            tutors = [summary.user for summary in chunk if summary.user.is_tutor]
+            top_list += tutors[:number_result - len(top_list)]
+            if len(chunk) < number_result:
+                break
+            start += number_result
+        if len(top_list) < number_result:
+            # not enough rated tutors yet, pad with the unrated ones like the old ranking did;
+            # select_related records their missing summary so the template doesn't look it up again
+            from accounts.models import User
+            top_list += User.objects.filter(
+                is_tutor=True,
+                rating_summary__isnull=True
+            ).select_related('rating_summary').order_by('id')[:number_result - len(top_list)]
+        return top_list
+
+    @classmethod
+    def rebuild(cls, user_ids=None):
+        """Recompute summaries from the Rating table, returns the number of rows written."""
+        rating_qs = Rating.objects.filter(to_user__isnull=False)
+        if user_ids is not None:
+            rating_qs = rating_qs.filter(to_user_id__in=user_ids)
+        totals = rating_qs.values('to_user_id').annotate(
+            rating_sum=models.Sum('rating'),
+            num_raters=models.Count('id')
+        )
+        summaries = []
+        for row in totals:
+            summary = cls(
+                user_id=row['to_user_id'],
+                rating_sum=row['rating_sum'] or 0,
+                num_raters=row['num_raters']
+            )
+            summary.avg_rating = summary.compute_avg()
+            summaries.append(summary)
+        with transaction.atomic():
+            stale_qs = cls.objects.all()
+            if user_ids is not None:
+                stale_qs = stale_qs.filter(user_id__in=user_ids)
+            stale_qs.delete()
+            cls.objects.bulk_create(summaries)
+        bump_fragment_version('sidebar')
+        return len(summaries)
+
 
 class Notify(models.Model):
     LIKE = '1'
@@ -54,19 +153,219 @@ class Notify(models.Model):
     rating = models.IntegerField(default=-1)
     seen = models.BooleanField(default=False)
     noti_date = models.DateTimeField(default=timezone.now)
+    # like/comment notifications are grouped per (to_user, noti_type, noti_post): from_user is the
+    # latest actor, num_actors counts everyone, recent_actors holds the latest ids newest first
+    num_actors = models.IntegerField(default=1)
+    recent_actors = models.CharField(max_length=100, blank=True, default='')
+
+    RECENT_ACTORS = 3
+
+    class Meta:
+        unique_together = ('to_user', 'noti_type', 'noti_post')
+        indexes = [
+            models.Index(fields=['to_user', 'seen'], name='notify_to_user_seen_idx'),
+            models.Index(fields=['to_user', '-noti_date'], name='notify_to_user_date_idx'),
+            models.Index(fields=['seen', 'noti_date'], name='notify_seen_date_idx'),
+        ]
 
     def __str__(self):
         return "{} {} {}".format(self.from_user.username, self.noti_type, self.to_user.username)
 
+    @classmethod
+    def add_unread(cls, unread_deltas):
+        """Shift the users' unread counters, unread_deltas maps user id -> delta."""
+        user_model = cls._meta.get_field('to_user').related_model
+        users_by_delta = {}
+        for user_id, delta in unread_deltas.items():
+            if delta:
+                users_by_delta.setdefault(delta, []).append(user_id)
+        # one UPDATE per distinct delta, a fan-out to many users is a single statement
+        for delta, user_ids in users_by_delta.items():
+            user_model.objects.filter(pk__in=user_ids).update(
+                num_unread_noties=models.F('num_unread_noties') + delta
+            )
+
+    @classmethod
+    def create_noti(cls, **kwargs):
+        with transaction.atomic():
+            noti = cls.objects.create(**kwargs)
+            if not noti.seen and noti.to_user_id is not None:
+                cls.add_unread({noti.to_user_id: 1})
+        return noti
+
+    @classmethod
+    def group_noties(cls, noti_type, noti_post, to_user_ids, num_actors, recent_actor_ids, actor_ids,
+                     new_actor=None):
+        """
+        Bring the grouped rows of one post in line with its current actors.
+        recent_actor_ids are the latest actors newest first, actor_ids the recipients who are actors
+        themselves (they don't count in their own row). With new_actor the rows of to_user_ids are
+        bumped as a fresh unseen event and created when missing. Every other existing row of the post
+        is only recounted, and dropped once nobody is left.
+        """
+        noti_qs = cls.objects.filter(noti_type=noti_type, noti_post=noti_post)
+        bump_user_ids = set()
+        if new_actor is not None:
+            bump_user_ids = set(to_user_ids)
+            bump_user_ids.discard(new_actor.id)
+        with transaction.atomic():
+            existing = dict(noti_qs.values_list('to_user_id', 'seen'))
+            groups = {}
+            for user_id in bump_user_ids.union(existing):
+                user_num_actors = num_actors - (1 if user_id in actor_ids else 0)
+                user_recent = [actor_id for actor_id in recent_actor_ids if actor_id != user_id]
+                key = (
+                    user_id in bump_user_ids,
+                    user_num_actors,
+                    ','.join(str(actor_id) for actor_id in user_recent[:cls.RECENT_ACTORS])
+                )
+                groups.setdefault(key, []).append(user_id)
+
+            unread_deltas = {}
+            new_noties = []
+            for (bump, user_num_actors, recent_actors), user_ids in groups.items():
+                group_qs = noti_qs.filter(to_user_id__in=user_ids)
+                if not bump:
+                    if user_num_actors <= 0:
+                        cls.delete_noties(group_qs)
+                    else:
+                        group_qs.update(
+                            from_user_id=int(recent_actors.split(',')[0]),
+                            num_actors=user_num_actors,
+                            recent_actors=recent_actors
+                        )
+                    continue
+                group_qs.update(
+                    from_user=new_actor,
+                    num_actors=user_num_actors,
+                    recent_actors=recent_actors,
+                    seen=False,
+                    noti_date=timezone.now()
+                )
+                for user_id in user_ids:
+                    if user_id not in existing:
+                        new_noties.append(cls(
+                            from_user=new_actor,
+                            to_user_id=user_id,
+                            noti_type=noti_type,
+                            noti_post=noti_post,
+                            num_actors=user_num_actors,
+                            recent_actors=recent_actors,
+                            seen=False
+                        ))
+                    if existing.get(user_id, True):
+                        unread_deltas[user_id] = 1
+            cls.objects.bulk_create(new_noties)
+            cls.add_unread(unread_deltas)
+
+    @classmethod
+    def update_like_noti(cls, post, new_actor=None, num_likes=None):
+        """
+        Regroup the like notification of a post, pass new_actor when someone just liked it and
+        num_likes when the number of likes is known already.
+        """
+        like_qs = post.likes.through.objects.filter(post=post)
+        recent_actor_ids = list(like_qs.order_by('-id').values_list('user_id', flat=True)[:cls.RECENT_ACTORS + 1])
+        actor_ids = set()
+        if like_qs.filter(user_id=post.author_id).exists():
+            actor_ids.add(post.author_id)
+        if num_likes is None:
+            num_likes = like_qs.count()
+        cls.group_noties(cls.LIKE, post, [post.author_id], num_likes, recent_actor_ids, actor_ids,
+                         new_actor=new_actor)
+
+    @classmethod
+    def update_comment_noties(cls, post, new_actor=None):
+        """Regroup the comment notifications of a post, pass new_actor when someone just commented."""
+        commenters = post.post_comments.order_by().values('author_id').annotate(
+            last_date=models.Max('created_date')
+        ).order_by('-last_date').values_list('author_id', 'last_date')
+        actor_ids = [author_id for author_id, last_date in commenters]
+        to_user_ids = set(actor_ids)
+        to_user_ids.add(post.author_id)
+        cls.group_noties(cls.COMMENT, post, to_user_ids, len(actor_ids), actor_ids[:cls.RECENT_ACTORS + 1],
+                         set(actor_ids), new_actor=new_actor)
+
+    @classmethod
+    def delete_noties(cls, noti_qs):
+        with transaction.atomic():
+            unread_counts = list(noti_qs.filter(
+                seen=False,
+                to_user__isnull=False
+            ).order_by().values_list('to_user_id').annotate(num=models.Count('id')))
+            noti_qs.delete()
+            cls.add_unread({user_id: -num for user_id, num in unread_counts})
+
+    @classmethod
+    def set_seen(cls, user):
+        with transaction.atomic():
+            cls.objects.filter(to_user=user, seen=False).update(seen=True)
+            user_model = cls._meta.get_field('to_user').related_model
+            user_model.objects.filter(pk=user.pk).update(num_unread_noties=0)
+        user.num_unread_noties = 0
+
+    @classmethod
+    def delete_old_seen(cls, before, batch_size=1000, pause=0):
+        """
+        Delete seen notifications older than before, batch_size rows per transaction so the write
+        lock is only held briefly, sleeping pause seconds between batches. Returns the number deleted.
+        """
+        num_deleted = 0
+        while True:
+            with transaction.atomic():
+                noti_ids = list(cls.objects.filter(
+                    seen=True,
+                    noti_date__lt=before
+                ).order_by('noti_date').values_list('id', flat=True)[:batch_size])
+                if not noti_ids:
+                    break
+                cls.objects.filter(id__in=noti_ids).delete()
+            num_deleted += len(noti_ids)
+            if len(noti_ids) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+        return num_deleted
+
+    @classmethod
+    def rebuild_unread(cls):
+        """Reset every user's unread counter from the Notify table, returns the number of users fixed."""
+        user_model = cls._meta.get_field('to_user').related_model
+        unread_counts = dict(cls.objects.filter(
+            seen=False,
+            to_user__isnull=False
+        ).order_by().values_list('to_user_id').annotate(num=models.Count('id')))
+        num_fixed = 0
+        with transaction.atomic():
+            for user_id, num_unread in user_model.objects.values_list('id', 'num_unread_noties'):
+                if unread_counts.get(user_id, 0) != num_unread:
+                    user_model.objects.filter(pk=user_id).update(num_unread_noties=unread_counts.get(user_id, 0))
+                    num_fixed += 1
+        return num_fixed
+
+    def get_recent_actor_ids(self):
+        return [int(actor_id) for actor_id in self.recent_actors.split(',') if actor_id]
+
+    def get_actors_str(self):
+        num_others = self.num_actors - 1
+        if num_others <= 0:
+            return self.from_user.username
+        return "{user} and {num} other{plural}".format(
+            user=self.from_user.username,
+            num=num_others,
+            plural='s' if num_others > 1 else ''
+        )
+
     def get_noti_str(self):
         if self.noti_type == self.LIKE:
-            return "{user} likes your post: {post_name}.".format(
-                user=self.from_user.username,
+            return "{users} {verb} your post: {post_name}.".format(
+                users=self.get_actors_str(),
+                verb='like' if self.num_actors > 1 else 'likes',
                 post_name=self.noti_post.title
             )
         elif self.noti_type == self.COMMENT:
-            return "{user} also commented to post: {post_name}.".format(
-                user=self.from_user.username,
+            return "{users} also commented to post: {post_name}.".format(
+                users=self.get_actors_str(),
                 post_name=self.noti_post.title
             )
         else:
@@ -74,3 +373,110 @@ class Notify(models.Model):
                 user=self.from_user.username,
                 rating=self.rating
             )
+
+
+class CommentNotiJob(models.Model):
+    """
+    A post whose comment notifications are waiting to be regrouped, written in the transaction of
+    the comment and run by the regroup_comment_noties command, for the posts with more comments
+    than a request should go through. Meant for a single worker.
+    """
+    # retries wait RETRY_DELAY seconds, doubled after every failure up to MAX_RETRY_DELAY
+    RETRY_DELAY = 10
+    MAX_RETRY_DELAY = 60 * 60
+
+    # one job per post, the comments that come in before it runs share it
+    post = models.OneToOneField('posts.Post', related_name='+')
+    # the author of the latest comment, the others get their rows bumped as a fresh event
+    new_actor = models.ForeignKey('accounts.User', null=True, on_delete=models.SET_NULL, related_name='+')
+    num_attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at'], name='comment_noti_job_due_idx'),
+        ]
+
+    def __str__(self):
+        return 'comment notifications of post {}'.format(self.post_id)
+
+    @classmethod
+    def enqueue(cls, post, new_actor):
+        """Queue the post, inside the transaction that saved the comment and locked the post."""
+        cls.objects.update_or_create(post=post, defaults={
+            'new_actor': new_actor,
+            'num_attempts': 0,
+            'next_attempt_at': timezone.now(),
+            'last_error': '',
+        })
+
+    def get_retry_delay(self):
+        return min(self.RETRY_DELAY * 2 ** (self.num_attempts - 1), self.MAX_RETRY_DELAY)
+
+    def run(self):
+        post_model = self._meta.get_field('post').related_model
+        with transaction.atomic():
+            # a write first, like in comment_on_post: it takes the SQLite write lock before anything
+            # is read and locks the post row elsewhere, new comments of the post wait for the job
+            post_model.objects.filter(id=self.post_id).update(comment_count=models.F('comment_count'))
+            # reread, a comment may have changed the job since it was picked
+            job = type(self).objects.select_related('post', 'new_actor').filter(id=self.id).first()
+            if job is None:
+                return
+            Notify.update_comment_noties(job.post, new_actor=job.new_actor)
+            job.delete()
+
+    @classmethod
+    def run_due(cls, batch_size=50):
+        """
+        Regroup up to batch_size queued posts that are due, returns (number done, number failed).
+        A failed job is retried later with a growing delay.
+        """
+        jobs = list(cls.objects.filter(
+            next_attempt_at__lte=timezone.now()
+        ).order_by('next_attempt_at', 'id')[:batch_size])
+        num_done = 0
+        for job in jobs:
+            try:
+                job.run()
+            except Exception as error:
+                job.num_attempts += 1
+                job.last_error = str(error)
+                job.next_attempt_at = timezone.now() + timedelta(seconds=job.get_retry_delay())
+                type(job).objects.filter(id=job.id).update(
+                    num_attempts=job.num_attempts,
+                    last_error=job.last_error,
+                    next_attempt_at=job.next_attempt_at
+                )
+                continue
+            num_done += 1
+        return num_done, len(jobs) - num_done
+
+
+@receiver(post_save, sender=School)
+@receiver(post_delete, sender=School)
+@receiver(post_save, sender=District)
+@receiver(post_delete, sender=District)
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+@receiver(post_save, sender=ClassLevel)
+@receiver(post_delete, sender=ClassLevel)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+@receiver(post_save, sender=RatingSummary)
+@receiver(post_delete, sender=RatingSummary)
+def invalidate_sidebar(sender, **kwargs):
+    bump_fragment_version('sidebar')
+
+
+# the cached post cards and facet counts show the names of these
+@receiver(post_save, sender=District)
+@receiver(post_delete, sender=District)
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+@receiver(post_save, sender=ClassLevel)
+@receiver(post_delete, sender=ClassLevel)
+def invalidate_post_labels(sender, **kwargs):
+    bump_fragment_version('post_card')
+    bump_fragment_version('post_facets')
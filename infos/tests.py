@@ -1,3 +1,324 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import User
+from final_project.test_utils import explain
+from posts.models import Comment, Post
+from .models import CommentNotiJob, Notify, Rating, RatingSummary
+
+
+@skipUnless(connection.vendor == 'sqlite', 'reads the plans of SQLite')
+class InfoQueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('student', 'student@example.com', 'password', is_active=True)
+        tutors = [User.objects.create_user('tutor{}'.format(i), is_active=True, is_tutor=True) for i in range(8)]
+        for i, tutor in enumerate(tutors):
+            Rating.objects.create(from_user=cls.user, to_user=tutor, rating=i % 5 + 1)
+            Notify.create_noti(from_user=cls.user, to_user=tutor, noti_type=Notify.RATING, rating=i % 5 + 1)
+            Notify.create_noti(from_user=tutor, to_user=cls.user, noti_type=Notify.RATING, rating=1,
+                               seen=i % 2 == 0, noti_date=timezone.now() - timedelta(days=i))
+        RatingSummary.rebuild()
+
+    def assertPlanUses(self, sql, index_name, params=()):
+        plan = explain(sql, params)
+        self.assertTrue(any(index_name in detail for detail in plan), '{}\n{}'.format(sql, '\n'.join(plan)))
+        return plan
+
+    def test_noties_feed(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('accounts:noties_feed'))
+        self.assertEqual(response.status_code, 200)
+        noti_queries = [query['sql'] for query in queries.captured_queries
+                        if query['sql'].startswith('SELECT') and 'FROM "infos_notify"' in query['sql']]
+        self.assertEqual(len(noti_queries), 1)
+        self.assertPlanUses(noti_queries[0], 'notify_to_user_date_idx')
+
+    def test_set_seen(self):
+        with CaptureQueriesContext(connection) as queries:
+            Notify.set_seen(self.user)
+        update, = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "infos_notify"')]
+        self.assertPlanUses(update, 'notify_to_user_seen_idx')
+        self.assertFalse(Notify.objects.filter(to_user=self.user, seen=False).exists())
+
+    def test_old_seen_noties(self):
+        sql, params = Notify.objects.filter(
+            seen=True,
+            noti_date__lt=timezone.now()
+        ).order_by('noti_date').values_list('id', flat=True)[:10].query.sql_with_params()
+        self.assertPlanUses(sql, 'notify_seen_date_idx', params)
+
+    def test_top_tutors(self):
+        with CaptureQueriesContext(connection) as queries:
+            top_tutors = RatingSummary.top_tutors(5)
+        self.assertEqual(len(top_tutors), 5)
+        # ties go to the older account
+        self.assertEqual([tutor.username for tutor in top_tutors],
+                         ['tutor4', 'tutor3', 'tutor2', 'tutor7', 'tutor1'])
+        plan = self.assertPlanUses(queries.captured_queries[0]['sql'], 'rating_summary_rank_idx')
+        self.assertFalse([detail for detail in plan if detail.startswith('SCAN') and 'USING' not in detail
+                          or 'TEMP B-TREE' in detail], '\n'.join(plan))
+
+
+class GroupedNotifyTests(TestCase):
+    """Likes and comments of a post add up in one notification row per recipient."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tutor = User.objects.create_user('tutor', is_active=True, is_tutor=True)
+        cls.anna, cls.binh, cls.chi = [User.objects.create_user(username, is_active=True)
+                                       for username in ('anna', 'binh', 'chi')]
+        cls.post = Post.objects.create(title='Algebra', author=cls.tutor, is_approved=True)
+
+    def like(self, user):
+        self.client.force_login(user)
+        response = self.client.post(reverse('posts:like_post', kwargs={'post_id': self.post.id}))
+        self.assertEqual(response.status_code, 200)
+
+    def comment(self, user):
+        self.client.force_login(user)
+        self.client.post(reverse('posts:comment_post', kwargs={'post_id': self.post.id}), {'text': 'Interested'})
+        return Comment.objects.filter(post=self.post, author=user).latest('id')
+
+    def assertNoti(self, noti_type, to_user, actors, noti_str, num_unread):
+        """to_user's row of the post has actors, newest first, and to_user has num_unread unread."""
+        noti_qs = Notify.objects.filter(noti_type=noti_type, noti_post=self.post, to_user=to_user)
+        if actors:
+            noti = noti_qs.get()
+            self.assertEqual(noti.num_actors, len(actors))
+            self.assertEqual(noti.get_recent_actor_ids(), [actor.id for actor in actors[:Notify.RECENT_ACTORS]])
+            self.assertEqual(noti.from_user, actors[0])
+            self.assertEqual(noti.get_noti_str(), noti_str)
+        else:
+            self.assertFalse(noti_qs.exists())
+        self.assertEqual(User.objects.get(id=to_user.id).num_unread_noties, num_unread)
+
+    def test_like(self):
+        self.like(self.anna)
+        self.assertNoti(Notify.LIKE, self.tutor, [self.anna], 'anna likes your post: Algebra.', 1)
+
+    def test_second_like(self):
+        self.like(self.anna)
+        self.like(self.binh)
+        # the row was still unseen, nothing more to read
+        self.assertNoti(Notify.LIKE, self.tutor, [self.binh, self.anna],
+                        'binh and 1 other like your post: Algebra.', 1)
+        Notify.set_seen(self.tutor)
+        self.like(self.chi)
+        self.assertNoti(Notify.LIKE, self.tutor, [self.chi, self.binh, self.anna],
+                        'chi and 2 others like your post: Algebra.', 1)
+        self.assertFalse(Notify.objects.get(noti_type=Notify.LIKE, noti_post=self.post).seen)
+
+    def test_unlike(self):
+        self.like(self.anna)
+        self.like(self.binh)
+        self.like(self.binh)
+        self.assertNoti(Notify.LIKE, self.tutor, [self.anna], 'anna likes your post: Algebra.', 1)
+        self.like(self.anna)
+        # nobody left, the unread row goes with its count
+        self.assertNoti(Notify.LIKE, self.tutor, [], '', 0)
+
+    def test_self_like(self):
+        self.like(self.tutor)
+        self.assertNoti(Notify.LIKE, self.tutor, [], '', 0)
+        self.like(self.anna)
+        # the author's own like is not counted in their row
+        self.assertNoti(Notify.LIKE, self.tutor, [self.anna], 'anna likes your post: Algebra.', 1)
+
+    def test_comment(self):
+        self.comment(self.anna)
+        self.assertNoti(Notify.COMMENT, self.tutor, [self.anna], 'anna also commented to post: Algebra.', 1)
+        self.assertNoti(Notify.COMMENT, self.anna, [], '', 0)
+        self.comment(self.binh)
+        self.assertNoti(Notify.COMMENT, self.tutor, [self.binh, self.anna],
+                        'binh and 1 other also commented to post: Algebra.', 1)
+        self.assertNoti(Notify.COMMENT, self.anna, [self.binh], 'binh also commented to post: Algebra.', 1)
+        self.assertNoti(Notify.COMMENT, self.binh, [], '', 0)
+
+    def test_author_comment(self):
+        self.comment(self.anna)
+        Notify.set_seen(self.tutor)
+        self.comment(self.tutor)
+        self.assertNoti(Notify.COMMENT, self.anna, [self.tutor], 'tutor also commented to post: Algebra.', 1)
+        # the author's row leaves them out and stays seen
+        self.assertNoti(Notify.COMMENT, self.tutor, [self.anna], 'anna also commented to post: Algebra.', 0)
+        self.assertTrue(Notify.objects.get(noti_type=Notify.COMMENT, to_user=self.tutor).seen)
+
+    def test_delete_comment(self):
+        self.comment(self.anna)
+        comment = self.comment(self.binh)
+        self.client.force_login(self.binh)
+        self.client.get(reverse('posts:delete_comment', kwargs={'post_id': self.post.id, 'comment_id': comment.id}))
+        self.assertNoti(Notify.COMMENT, self.tutor, [self.anna], 'anna also commented to post: Algebra.', 1)
+        # binh was the only other commenter anna heard of
+        self.assertNoti(Notify.COMMENT, self.anna, [], '', 0)
+        self.assertEqual(Post.objects.get(id=self.post.id).comment_count, 1)
+
+
+@override_settings(COMMENT_NOTI_BACKGROUND_MIN_COMMENTS=2)
+class CommentNotiJobTests(TestCase):
+    """The comment notifications of busy posts are queued with the comment and regrouped later."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tutor = User.objects.create_user('tutor', is_active=True, is_tutor=True)
+        cls.anna, cls.binh = [User.objects.create_user(username, is_active=True) for username in ('anna', 'binh')]
+        cls.post = Post.objects.create(title='Algebra', author=cls.tutor, is_approved=True)
+
+    def comment(self, user):
+        self.client.force_login(user)
+        self.client.post(reverse('posts:comment_post', kwargs={'post_id': self.post.id}), {'text': 'Interested'})
+
+    def get_actor_ids(self, to_user):
+        noti = Notify.objects.get(noti_type=Notify.COMMENT, noti_post=self.post, to_user=to_user)
+        return noti.num_actors, noti.get_recent_actor_ids()
+
+    def test_queued(self):
+        # below the threshold, grouped in the request
+        self.comment(self.anna)
+        self.assertEqual(self.get_actor_ids(self.tutor), (1, [self.anna.id]))
+        self.assertFalse(CommentNotiJob.objects.exists())
+
+        self.comment(self.binh)
+        self.comment(self.anna)
+        self.assertEqual(self.get_actor_ids(self.tutor), (1, [self.anna.id]))
+        job = CommentNotiJob.objects.get()
+        self.assertEqual((job.post_id, job.new_actor_id), (self.post.id, self.anna.id))
+
+        self.assertEqual(CommentNotiJob.run_due(), (1, 0))
+        self.assertEqual(self.get_actor_ids(self.tutor), (2, [self.anna.id, self.binh.id]))
+        self.assertEqual(self.get_actor_ids(self.binh), (1, [self.anna.id]))
+        self.assertEqual(User.objects.get(id=self.binh.id).num_unread_noties, 1)
+        self.assertFalse(CommentNotiJob.objects.exists())
+
+    def test_failed_job_retried(self):
+        self.comment(self.anna)
+        self.comment(self.binh)
+        with mock.patch.object(Notify, 'update_comment_noties', side_effect=DatabaseError('database is locked')):
+            self.assertEqual(CommentNotiJob.run_due(), (0, 1))
+        job = CommentNotiJob.objects.get()
+        self.assertEqual((job.num_attempts, job.last_error), (1, 'database is locked'))
+        self.assertGreater(job.next_attempt_at, timezone.now())
+        # not due yet
+        self.assertEqual(CommentNotiJob.run_due(), (0, 0))
+        CommentNotiJob.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(CommentNotiJob.run_due(), (1, 0))
+        self.assertEqual(self.get_actor_ids(self.tutor), (2, [self.binh.id, self.anna.id]))
+
+    def test_retry_delay_is_capped(self):
+        self.assertEqual(CommentNotiJob(num_attempts=30).get_retry_delay(), CommentNotiJob.MAX_RETRY_DELAY)
+
+    def test_command(self):
+        self.comment(self.anna)
+        self.comment(self.binh)
+        out = io.StringIO()
+        call_command('regroup_comment_noties', stdout=out)
+        self.assertIn('Regrouped the notifications of 1 posts, 0 attempts failed.', out.getvalue())
+        self.assertEqual(self.get_actor_ids(self.anna), (1, [self.binh.id]))
+
+    def test_deleted_post(self):
+        self.comment(self.anna)
+        self.comment(self.binh)
+        Post.objects.filter(id=self.post.id).delete()
+        self.assertFalse(CommentNotiJob.objects.exists())
+
+
+class RemoveDuplicateRatingsMigrationTests(TransactionTestCase):
+    """infos 0013 keeps the latest vote of a student for a tutor and its notification."""
+    migrate_from = [('infos', '0012_ratingsummary')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.old_apps = executor.loader.project_state(self.migrate_from).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_removed(self):
+        OldUser = self.old_apps.get_model('accounts', 'User')
+        OldRating = self.old_apps.get_model('infos', 'Rating')
+        OldNotify = self.old_apps.get_model('infos', 'Notify')
+        OldRatingSummary = self.old_apps.get_model('infos', 'RatingSummary')
+        student = OldUser.objects.create(username='student')
+        other = OldUser.objects.create(username='other')
+        tutor = OldUser.objects.create(username='tutor', is_tutor=True)
+        now = timezone.now()
+        for i, rating in enumerate((2, 5)):
+            OldRating.objects.create(from_user=student, to_user=tutor, rating=rating)
+            OldNotify.objects.create(from_user=student, to_user=tutor, noti_type=Notify.RATING, rating=rating,
+                                     seen=i == 1, noti_date=now - timedelta(days=2 - i))
+        OldRating.objects.create(from_user=other, to_user=tutor, rating=4)
+        OldNotify.objects.create(from_user=other, to_user=tutor, noti_type=Notify.RATING, rating=4, seen=True)
+        # counted every vote
+        OldRatingSummary.objects.create(user=tutor, rating_sum=11, num_raters=3, avg_rating=11 / 3)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+        self.assertEqual(sorted(Rating.objects.values_list('from_user_id', 'rating')),
+                         [(student.id, 5), (other.id, 4)])
+        self.assertEqual(sorted(Notify.objects.values_list('from_user_id', 'rating', 'seen')),
+                         [(student.id, 5, False), (other.id, 4, True)])
+        # one unseen notification left, as the kept one carries over the unseen duplicate
+        self.assertEqual(User.objects.get(id=tutor.id).num_unread_noties, 1)
+        summary = RatingSummary.objects.get(user_id=tutor.id)
+        self.assertEqual((summary.num_raters, summary.rating_sum, summary.avg_rating), (2, 9, 3))
+
+
+class GroupNotiesMigrationTests(TransactionTestCase):
+    """infos 0014 collapses the like and comment notifications of a post into one row per recipient."""
+    migrate_from = [('infos', '0013_auto_20261019_0309'), ('posts', '0005_auto_20261019_0309'),
+                    ('accounts', '0010_user_num_unread_noties')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.old_apps = executor.loader.project_state(self.migrate_from).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_noties_grouped(self):
+        OldUser = self.old_apps.get_model('accounts', 'User')
+        OldPost = self.old_apps.get_model('posts', 'Post')
+        OldNotify = self.old_apps.get_model('infos', 'Notify')
+        tutor = OldUser.objects.create(username='tutor', is_tutor=True, num_unread_noties=5)
+        anna, binh, chi = [OldUser.objects.create(username=username) for username in ('anna', 'binh', 'chi')]
+        post = OldPost.objects.create(title='Algebra', author=tutor)
+        now = timezone.now()
+        for days, from_user, seen in ((3, anna, True), (2, binh, False), (1, anna, True)):
+            OldNotify.objects.create(from_user=from_user, to_user=tutor, noti_type=Notify.LIKE, noti_post=post,
+                                     seen=seen, noti_date=now - timedelta(days=days))
+        for days, from_user in ((2, binh), (1, chi)):
+            OldNotify.objects.create(from_user=from_user, to_user=anna, noti_type=Notify.COMMENT, noti_post=post,
+                                     seen=True, noti_date=now - timedelta(days=days))
+        OldNotify.objects.create(from_user=anna, to_user=tutor, noti_type=Notify.RATING, rating=5)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+        like = Notify.objects.get(noti_type=Notify.LIKE)
+        self.assertEqual((like.to_user_id, like.from_user_id, like.num_actors, like.get_recent_actor_ids(), like.seen),
+                         (tutor.id, anna.id, 2, [anna.id, binh.id], False))
+        comment = Notify.objects.get(noti_type=Notify.COMMENT)
+        self.assertEqual((comment.to_user_id, comment.from_user_id, comment.num_actors,
+                          comment.get_recent_actor_ids(), comment.seen),
+                         (anna.id, chi.id, 2, [chi.id, binh.id], True))
+        self.assertEqual(Notify.objects.filter(noti_type=Notify.RATING).count(), 1)
+        # recounted from the rows left: the like and the rating
+        self.assertEqual(User.objects.get(id=tutor.id).num_unread_noties, 2)
+        self.assertEqual(User.objects.get(id=anna.id).num_unread_noties, 0)
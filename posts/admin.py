@@ -1,6 +1,31 @@
 from django.contrib import admin
 
-from .models import Post, Comment
+from .models import Post, Comment, ModerationBatch
 
-admin.site.register(Post)
+
+class PostAdmin(admin.ModelAdmin):
+    list_display = ('title', 'author', 'is_approved', 'created_at')
+    list_filter = ('is_approved', 'author__is_tutor', 'district', 'subject')
+    actions = ('approve_posts', 'reject_posts')
+
+    def approve_posts(self, request, queryset):
+        batch = ModerationBatch.moderate(request.user, queryset, ModerationBatch.APPROVE,
+                                         selection='admin action')
+        self.message_user(request, "Approved {} posts.".format(batch.num_posts))
+    approve_posts.short_description = 'Approve selected pending posts'
+
+    def reject_posts(self, request, queryset):
+        batch = ModerationBatch.moderate(request.user, queryset, ModerationBatch.REJECT,
+                                         selection='admin action')
+        self.message_user(request, "Rejected {} posts.".format(batch.num_posts))
+    reject_posts.short_description = 'Reject (delete) selected pending posts'
+
+
+class ModerationBatchAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'moderator', 'action', 'num_posts', 'selection')
+    list_filter = ('action',)
+
+
+admin.site.register(Post, PostAdmin)
 admin.site.register(Comment)
+admin.site.register(ModerationBatch, ModerationBatchAdmin)
@@ -0,0 +1,63 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from infos.fragment_cache import get_fragment_versions
+
+FACET_CACHE_TIMEOUT = 600
+
+# facet name -> (post field, field holding the label shown for a value)
+FACET_FIELDS = (
+    ('district', 'district_id', 'district__name'),
+    ('subject', 'subject_id', 'subject__name'),
+    ('class_level', 'class_level_id', 'class_level__class_level'),
+)
+
+
+def get_cache_key(*filter_values):
+    # keywords are free text, hash everything into a key every cache backend accepts
+    filter_str = '|'.join('' if value is None else str(value) for value in filter_values)
+    version = get_fragment_versions()['post_facets']
+    return 'post_facets:{}:{}'.format(version, hashlib.md5(filter_str.encode('utf-8')).hexdigest())
+
+
+def count_facets(post_qs):
+    """
+    Number of posts of post_qs per district, subject, class level and author kind, from a single
+    GROUP BY over the combinations that occur.
+    """
+    group_fields = [value_field for _, value_field, _ in FACET_FIELDS]
+    group_fields += [label_field for _, _, label_field in FACET_FIELDS]
+    group_fields.append('author__is_tutor')
+    rows = post_qs.order_by().values(*group_fields).annotate(num_posts=Count('id'))
+
+    facet_counts = {name: {} for name, _, _ in FACET_FIELDS}
+    author_counts = {'tutor': 0, 'student': 0}
+    for row in rows:
+        for name, value_field, label_field in FACET_FIELDS:
+            value = row[value_field]
+            if value is None:
+                continue
+            label, num_posts = facet_counts[name].get(value, (row[label_field], 0))
+            facet_counts[name][value] = (label, num_posts + row['num_posts'])
+        author_counts['tutor' if row['author__is_tutor'] else 'student'] += row['num_posts']
+
+    facets = {}
+    for name, counts in facet_counts.items():
+        facets[name] = sorted(
+            ((value, label, num_posts) for value, (label, num_posts) in counts.items()),
+            key=lambda facet: (-facet[2], str(facet[1]))
+        )
+    facets['author'] = author_counts
+    return facets
+
+
+def get_facets(post_qs, *filter_values):
+    """count_facets(post_qs) cached per filter combination until a post changes."""
+    key = get_cache_key(*filter_values)
+    facets = cache.get(key)
+    if facets is None:
+        facets = count_facets(post_qs)
+        cache.set(key, facets, FACET_CACHE_TIMEOUT)
+    return facets
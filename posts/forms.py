@@ -13,6 +13,8 @@ class CommentForm(forms.ModelForm):
 
 
 class PostSearchForm(forms.ModelForm):
+    keywords = forms.CharField(required=False, max_length=100)
+
     class Meta:
         model = Post
         fields = ('district', 'subject', 'class_level',)
@@ -0,0 +1,156 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connection, connections
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from accounts.models import User
+from infos.models import Notify
+from posts.models import Comment, Post
+
+# what each configuration changes on top of the settings
+CONFIGS = {
+    'settings': {},
+    # Django's own SQLite setup: rollback journal, full sync, the 5 s timeout of the sqlite3 module
+    'sqlite-default': {'SQLITE_PRAGMAS': (('journal_mode', 'DELETE'), ('synchronous', 'FULL'))},
+    'sqlite-wal': {'SQLITE_PRAGMAS': (
+        ('busy_timeout', 5000), ('journal_mode', 'WAL'), ('synchronous', 'NORMAL')
+    )},
+    'no-persistent': {'CONN_MAX_AGE': 0},
+}
+
+
+class Command(BaseCommand):
+    help = ('Like and comment on a few posts from parallel threads through the views, under each '
+            'database configuration, and report throughput, latency, errors and whether the like '
+            'and comment counters stayed right. The posts are created for the run and deleted after.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--config', action='append', choices=sorted(CONFIGS), dest='configs',
+                            help='Configuration to run, repeat for several. By default the settings, '
+                                 'sqlite-default and sqlite-wal on SQLite, no-persistent on other databases.')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--ops', type=int, default=50, help='Writes per thread.')
+        parser.add_argument('--posts', type=int, default=3, help='Posts the writes go to.')
+        parser.add_argument('--comment-share', type=float, default=0.3,
+                            help='Share of the writes that are comments, the others toggle a like.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        configs = options['configs'] or (
+            # the settings last, they set the journal mode the database file is left in
+            ['sqlite-default', 'sqlite-wal', 'settings'] if connection.vendor == 'sqlite'
+            else ['no-persistent', 'settings']
+        )
+        users = list(User.objects.filter(is_active=True).order_by('id')[:options['threads']])
+        if len(users) < options['threads']:
+            raise CommandError('Needs {} active users, run generate_dataset first.'.format(options['threads']))
+
+        # the test client's host and the per-request log of the middleware
+        setup_test_environment()
+        request_logger = logging.getLogger('final_project.requests')
+        request_logger_disabled = request_logger.disabled
+        request_logger.disabled = True
+        try:
+            for name in configs:
+                with self.configured(name):
+                    result = self.run(users, options)
+                self.stdout.write(
+                    '{:<15} {:>5} writes  {:>7.1f}/s  p50 {:>7.1f} ms  p95 {:>7.1f} ms  max {:>7.1f} ms  '
+                    '{} errors  {} wrong counters'.format(name, *result)
+                )
+                if result[-2]:
+                    self.stderr.write('  first error: {}'.format(self.errors[0]))
+        finally:
+            request_logger.disabled = request_logger_disabled
+            teardown_test_environment()
+
+    @contextmanager
+    def configured(self, name):
+        """Apply a configuration to the connections opened inside, the running ones are closed."""
+        overrides = dict(CONFIGS[name])
+        database = connections.databases[DEFAULT_DB_ALIAS]
+        conn_max_age = database['CONN_MAX_AGE']
+        database['CONN_MAX_AGE'] = overrides.pop('CONN_MAX_AGE', conn_max_age)
+        connections.close_all()
+        try:
+            with override_settings(**overrides):
+                yield
+                connections.close_all()
+        finally:
+            database['CONN_MAX_AGE'] = conn_max_age
+
+    def run(self, users, options):
+        """(writes, writes/s, p50 ms, p95 ms, max ms, errors, wrong counters) of one round."""
+        posts = [Post.objects.create(title='Concurrent writes {}'.format(i), author=users[0], is_approved=False)
+                 for i in range(options['posts'])]
+        post_ids = [post.id for post in posts]
+        latencies = []
+        self.errors = []
+        num_comments = [0]
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(users))
+
+        def work(index, user):
+            rng = random.Random(options['seed'] + index)
+            client = Client()
+            client.force_login(user)
+            barrier.wait()
+            for _ in range(options['ops']):
+                post_id = rng.choice(post_ids)
+                is_comment = rng.random() < options['comment_share']
+                # what the request handler does around every request
+                close_old_connections()
+                started = time.perf_counter()
+                try:
+                    if is_comment:
+                        response = client.post(reverse('posts:comment_post', kwargs={'post_id': post_id}),
+                                               {'text': 'comment {}'.format(rng.random())})
+                    else:
+                        response = client.get(reverse('posts:like_post', kwargs={'post_id': post_id}))
+                    error = None if response.status_code in (200, 302) else 'status {}'.format(response.status_code)
+                except Exception as e:
+                    error = repr(e)
+                finally:
+                    duration = time.perf_counter() - started
+                    close_old_connections()
+                with lock:
+                    latencies.append(duration)
+                    if error:
+                        self.errors.append(error)
+                    elif is_comment:
+                        num_comments[0] += 1
+            connection.close()
+
+        threads = [threading.Thread(target=work, args=(index, user)) for index, user in enumerate(users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            num_wrong = Post.repair_counts(post_ids)
+            if Comment.objects.filter(post_id__in=post_ids).count() != num_comments[0]:
+                self.errors.append('a comment reported as failed was saved, or the other way round')
+        finally:
+            Notify.delete_noties(Notify.objects.filter(noti_post__in=post_ids))
+            for post in posts:
+                post.delete()
+        latencies.sort()
+        return (
+            len(latencies),
+            len(latencies) / elapsed,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.95)] * 1000,
+            latencies[-1] * 1000,
+            len(self.errors),
+            num_wrong,
+        )
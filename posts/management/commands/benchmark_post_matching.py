@@ -0,0 +1,74 @@
+import itertools
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from infos.fragment_cache import get_fragment_versions
+from infos.models import ClassLevel, District, Subject
+from posts.forms import PostSearchForm
+from posts.matching import PostMatchIndex
+from posts.views import FilterPost, find_post
+
+
+class Command(BaseCommand):
+    help = ('Time find_post in SQL against the in-process match index over combinations of '
+            'search values, and check that both return the same posts.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-values', type=int, default=5,
+                            help='Search values tried per field, besides none.')
+        parser.add_argument('--page-size', type=int, default=4)
+
+    def handle(self, *args, **options):
+        max_values = options['max_values']
+        page_size = options['page_size']
+        field_values = [
+            [None] + list(model.objects.values_list('id', flat=True)[:max_values])
+            for model in (District, Subject, ClassLevel)
+        ]
+        started = time.perf_counter()
+        index = PostMatchIndex.build(get_fragment_versions()['post_facets'])
+        self.stdout.write('Index of {} posts built in {:.1f} ms.'.format(
+            len(index.post_slots), (time.perf_counter() - started) * 1000))
+
+        sql_times = []
+        index_times = []
+        mismatches = 0
+        for values in itertools.product(*field_values):
+            form = PostSearchForm(dict(zip(('district', 'subject', 'class_level'), values)))
+            if not form.is_valid():
+                continue
+            for filter_param in FilterPost:
+                with override_settings(POST_MATCH_INDEX=False):
+                    started = time.perf_counter()
+                    sql_result = find_post(form, filter_param.value)
+                    sql_page = list(sql_result['rank_posts'][:page_size])
+                    sql_times.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                is_tutor = {FilterPost.STUDENT: False, FilterPost.TUTOR: True}.get(filter_param)
+                match_result = index.match(*values, is_tutor=is_tutor)
+                index_ids = [post_id for post_id, _ in match_result.get_ranked_ids(0, page_size)]
+                index_times.append(time.perf_counter() - started)
+
+                # posts created at the same moment may come in any order in SQL, compare ranks
+                sql_ranks = sorted((post.rank, post.created_at, post.id) for post in sql_page)
+                index_posts = {post.id: post for post in match_result[:page_size]}
+                index_ranks = sorted((post.rank, post.created_at, post.id) for post in index_posts.values())
+                if (sql_result['num_results'], sql_result['matches']) != (match_result.num_results,
+                                                                          match_result.matches) \
+                        or [rank[:2] for rank in sql_ranks] != [rank[:2] for rank in index_ranks] \
+                        or len(index_ids) != len(sql_page):
+                    mismatches += 1
+                    self.stderr.write('Mismatch for {} {}'.format(values, filter_param.name))
+
+        for name, times in (('sql', sql_times), ('index', index_times)):
+            times.sort()
+            if times:
+                self.stdout.write('{:>6}: {} searches, p50 {:.3f} ms, p95 {:.3f} ms'.format(
+                    name, len(times), times[len(times) // 2] * 1000, times[int(len(times) * 0.95)] * 1000))
+        if mismatches:
+            self.stderr.write('{} searches differ.'.format(mismatches))
+        else:
+            self.stdout.write(self.style.SUCCESS('Both return the same posts.'))
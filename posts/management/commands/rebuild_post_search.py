@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of the posts from the Post table.'
+
+    def handle(self, *args, **options):
+        if not search.fts_supported():
+            self.stdout.write('The database has no full-text index, searches use icontains.')
+            return
+        num_rows = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Indexed {} posts.'.format(num_rows)))
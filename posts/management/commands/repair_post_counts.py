@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Recompute the like and comment counts of the posts from the likes and Comment tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('post_ids', nargs='*', type=int,
+                            help='Only repair the counts of these posts.')
+
+    def handle(self, *args, **options):
+        post_ids = options['post_ids'] or None
+        num_fixed = Post.repair_counts(post_ids=post_ids)
+        self.stdout.write(self.style.SUCCESS('Fixed the counts of {} posts.'.format(num_fixed)))
@@ -0,0 +1,249 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from infos.fragment_cache import get_fragment_versions
+
+MATCH_FIELDS = ('district_id', 'subject_id', 'class_level_id')
+# author kinds (User.is_tutor) are only reread by a rebuild, so rebuild at least this often
+MATCH_INDEX_MAX_AGE = 300
+
+
+def popcount(bitmap):
+    return bin(bitmap).count('1')
+
+
+def bitmap_from_slots(slots, num_slots):
+    bits = bytearray((num_slots + 7) // 8)
+    for slot in slots:
+        bits[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(bytes(bits), 'little')
+
+
+def slots_desc(bitmap, offset, limit):
+    """Up to limit set bits of bitmap, highest first, after skipping offset of them."""
+    bits = bin(bitmap)[2:]
+    top = len(bits) - 1
+    slots = []
+    pos = bits.find('1')
+    while pos != -1 and len(slots) < limit:
+        if offset:
+            offset -= 1
+        else:
+            slots.append(top - pos)
+        pos = bits.find('1', pos + 1)
+    return slots
+
+
+class PostMatchIndex:
+    """
+    Postings of the approved posts per district, subject and class level (None standing for the
+    posts without one) and of the tutors' posts, as bitmaps over slots. Slots are handed out in
+    created_at order, so reading bits from the top gives the newest posts first; a saved post
+    moves to a new top slot since auto_now set its created_at to now.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.built_at = time.time()
+        self.slot_post_ids = []
+        self.post_slots = {}
+        self.postings = {}
+        self.tutors = 0
+        self.all = 0
+
+    @classmethod
+    def build(cls, version):
+        from .models import Post
+
+        index = cls(version)
+        rows = Post.objects.filter(is_approved=True).order_by('created_at', 'id').values_list(
+            'id', *MATCH_FIELDS, 'author__is_tutor'
+        )
+        slots_per_key = {}
+        tutor_slots = []
+        for slot, (post_id, district_id, subject_id, class_level_id, is_tutor) in enumerate(rows.iterator()):
+            index.slot_post_ids.append(post_id)
+            index.post_slots[post_id] = slot
+            for key in zip(MATCH_FIELDS, (district_id, subject_id, class_level_id)):
+                slots_per_key.setdefault(key, []).append(slot)
+            if is_tutor:
+                tutor_slots.append(slot)
+        num_slots = len(index.slot_post_ids)
+        for key, slots in slots_per_key.items():
+            index.postings[key] = bitmap_from_slots(slots, num_slots)
+        index.tutors = bitmap_from_slots(tutor_slots, num_slots)
+        index.all = (1 << num_slots) - 1
+        return index
+
+    def is_current(self, version):
+        if self.version != version or time.time() - self.built_at > MATCH_INDEX_MAX_AGE:
+            return False
+        # every save leaves a dead slot behind, start over once they are the majority
+        return len(self.slot_post_ids) <= 2 * len(self.post_slots) + 1000
+
+    def remove(self, post_id):
+        slot = self.post_slots.pop(post_id, None)
+        if slot is None:
+            return
+        keep = ~(1 << slot)
+        for key in self.postings:
+            self.postings[key] &= keep
+        self.tutors &= keep
+        self.all &= keep
+
+    def add(self, post_id, district_id, subject_id, class_level_id, is_tutor):
+        slot = len(self.slot_post_ids)
+        bit = 1 << slot
+        self.slot_post_ids.append(post_id)
+        self.post_slots[post_id] = slot
+        for key in zip(MATCH_FIELDS, (district_id, subject_id, class_level_id)):
+            self.postings[key] = self.postings.get(key, 0) | bit
+        if is_tutor:
+            self.tutors |= bit
+        self.all |= bit
+
+    def match(self, district_id, subject_id, class_level_id, is_tutor=None):
+        """
+        Same posts, counts and order as find_post's SQL: posts having at least one of the values
+        (a None value matching the posts without one), ranked by how many values they match,
+        a None value counting as matched.
+        """
+        candidates = 0
+        rank_bitmaps = []
+        for key in zip(MATCH_FIELDS, (district_id, subject_id, class_level_id)):
+            posting = self.postings.get(key, 0)
+            candidates |= posting
+            rank_bitmaps.append(self.all if key[1] is None else posting)
+        if is_tutor is True:
+            candidates &= self.tutors
+        elif is_tutor is False:
+            candidates &= ~self.tutors
+        a, b, c = (bitmap & candidates for bitmap in rank_bitmaps)
+        # add the three rank bits of every post at once: rank = 2 * carry + low
+        low = a ^ b ^ c
+        carry = (a & b) | (c & (a ^ b))
+        tiers = (
+            (3, carry & low),
+            (2, carry & ~low),
+            (1, ~carry & low),
+        )
+        return MatchResult(self, tiers)
+
+
+class MatchResult:
+    """The ranked posts of a match, sliced into Post objects like a queryset for the Paginator."""
+
+    def __init__(self, index, tiers):
+        self.index = index
+        self.tiers = [(rank, bitmap, popcount(bitmap)) for rank, bitmap in tiers]
+        self.num_results = sum(num_posts for _, _, num_posts in self.tiers)
+        # full matches are the posts of rank 3
+        self.matches = self.tiers[0][2]
+
+    def __len__(self):
+        return self.num_results
+
+    def count(self):
+        return self.num_results
+
+    def get_ranked_ids(self, offset, limit):
+        ranked_ids = []
+        for rank, bitmap, num_posts in self.tiers:
+            if offset >= num_posts:
+                offset -= num_posts
+                continue
+            slots = slots_desc(bitmap, offset, limit - len(ranked_ids))
+            ranked_ids.extend((self.index.slot_post_ids[slot], rank) for slot in slots)
+            offset = 0
+            if len(ranked_ids) >= limit:
+                break
+        return ranked_ids
+
+    def __getitem__(self, key):
+        from .models import Post
+
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = self.num_results if key.stop is None else key.stop
+        ranked_ids = self.get_ranked_ids(start, stop - start)
+        posts = Post.objects.filter(
+            id__in=[post_id for post_id, _ in ranked_ids],
+            is_approved=True
+        ).select_related('author', 'district', 'subject', 'class_level').in_bulk()
+        page = []
+        for post_id, rank in ranked_ids:
+            # the post may be gone since the index was read
+            if post_id in posts:
+                post = posts[post_id]
+                post.rank = rank
+                page.append(post)
+        return page
+
+
+_index = None
+_index_lock = threading.Lock()
+_rebuilding = threading.Event()
+
+
+def rebuild_in_background(version):
+    if _rebuilding.is_set():
+        return
+    _rebuilding.set()
+
+    def run():
+        global _index
+        try:
+            index = PostMatchIndex.build(version)
+            with _index_lock:
+                _index = index
+        finally:
+            _rebuilding.clear()
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_index():
+    """
+    The index if it is loaded and up to date, None otherwise (and then it is rebuilt in the
+    background, meanwhile searches run in SQL).
+    """
+    if not settings.POST_MATCH_INDEX:
+        return None
+    version = get_fragment_versions()['post_facets']
+    index = _index
+    if index is not None and index.is_current(version):
+        return index
+    rebuild_in_background(version)
+    return None
+
+
+def post_changed(post, version, deleted=False):
+    """
+    Apply a saved or deleted post to the loaded index once the change commits. version is the
+    post_facets version the change bumped to, an index that missed a change in between is left
+    stale and rebuilt.
+    """
+    if _index is None:
+        return
+    row = None
+    if not deleted and post.is_approved:
+        row = (post.id, post.district_id, post.subject_id, post.class_level_id, post.author.is_tutor)
+    post_id = post.id
+
+    def apply():
+        with _index_lock:
+            index = _index
+            # an index built after the bump may or may not hold the change, applying it again is harmless
+            if index is None or index.version not in (version - 1, version):
+                return
+            index.remove(post_id)
+            if row is not None:
+                index.add(*row)
+            index.version = version
+
+    transaction.on_commit(apply)
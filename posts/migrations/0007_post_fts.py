@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def create_post_fts(apps, schema_editor):
+    from posts import search
+    search.rebuild_index(schema_editor.connection)
+
+
+def drop_post_fts(apps, schema_editor):
+    from posts import search
+    search.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_moderationbatch'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_post_fts, drop_post_fts),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_post_counts(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    like_counts = Post.likes.through.objects.order_by().values_list('post_id').annotate(num=models.Count('id'))
+    for post_id, num_likes in like_counts:
+        Post.objects.filter(id=post_id).update(like_count=num_likes)
+    comment_counts = Comment.objects.order_by().values_list('post_id').annotate(num=models.Count('id'))
+    for post_id, num_comments in comment_counts:
+        Post.objects.filter(id=post_id).update(comment_count=num_comments)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_post_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_post_counts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['is_approved', '-like_count', '-created_at'], name='post_approved_likes_idx'),
+        ),
+    ]
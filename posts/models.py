@@ -1,10 +1,21 @@
+from django.core.cache import cache
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 
 from accounts.models import User
-from infos.models import District, Subject, ClassLevel
+from infos.fragment_cache import bump_fragment_version
+from infos.models import District, Subject, ClassLevel, Notify
+from . import matching, search
+
+
+NUM_PENDING_CACHE_KEY = 'num_pending_posts'
+# safety net for processes that do not share a cache and so miss each other's invalidations
+NUM_PENDING_CACHE_TIMEOUT = 60
 
 
 class Post(models.Model):
@@ -20,10 +31,24 @@ class Post(models.Model):
     likes = models.ManyToManyField(User, related_name='like_posts')
     is_approved = models.BooleanField(default=False)
     is_closed = models.BooleanField(default=False)
+    # denormalized, changed with F() in the like and comment views, repair_post_counts fixes drift
+    like_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+
+    COUNT_FIELDS = ('like_count', 'comment_count')
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # a post loaded before a like or comment came in must not write its old counts back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNT_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def is_tutor(self):
         return self.author.is_tutor
 
@@ -33,8 +58,108 @@ class Post(models.Model):
     def get_liked_users(self):
         return self.likes.all()
 
+    @classmethod
+    def count_pending(cls):
+        """Number of posts waiting for approval, counted in the database."""
+        return cls.objects.filter(is_approved=False).count()
+
+    @classmethod
+    def get_num_pending(cls):
+        """Number of posts waiting for approval, cached until a post is saved or deleted."""
+        num_pending = cache.get(NUM_PENDING_CACHE_KEY)
+        if num_pending is None:
+            num_pending = cls.count_pending()
+            cache.set(NUM_PENDING_CACHE_KEY, num_pending, NUM_PENDING_CACHE_TIMEOUT)
+        return num_pending
+
+    @classmethod
+    def attach_list_stats(cls, posts, user):
+        """Set is_liked on a page of posts in at most 1 query, the counts are columns."""
+        posts = list(posts)
+        liked_ids = set()
+        if posts and user.is_authenticated:
+            liked_ids = set(cls.likes.through.objects.filter(
+                post_id__in=[post.id for post in posts],
+                user_id=user.id
+            ).values_list('post_id', flat=True))
+        for post in posts:
+            post.is_liked = post.id in liked_ids
+        return posts
+
+    @classmethod
+    def add_to_counts(cls, post_id, **deltas):
+        """add_to_counts(post.id, like_count=1) adds in SQL, safe against concurrent requests."""
+        cls.objects.filter(id=post_id).update(**{
+            field_name: models.F(field_name) + delta for field_name, delta in deltas.items()
+        })
+
+    @classmethod
+    def toggle_like(cls, post_id, user):
+        """
+        Like the post for user, or take the like back, in one transaction: returns (post,
+        is_liked, like_count). The DELETE goes first so that SQLite takes its write lock before
+        anything is read, the post row lock then queues toggles of the same post on other
+        databases. Raises Post.DoesNotExist.
+        """
+        like_model = cls.likes.through
+        # request.user is lazy, load it before the transaction starts
+        user_id = user.id
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            'DELETE FROM {} WHERE post_id = %s AND user_id = %s'.format(like_model._meta.db_table),
+                            [post_id, user_id]
+                        )
+                        num_deleted = cursor.rowcount
+                    post = cls.objects.select_for_update().get(id=post_id)
+                    is_liked = not num_deleted
+                    if is_liked:
+                        like_model.objects.create(post_id=post_id, user_id=user_id)
+                    delta = 1 if is_liked else -1
+                    cls.add_to_counts(post_id, like_count=delta)
+                    like_count = post.like_count + delta
+                    Notify.update_like_noti(post, new_actor=user if is_liked else None, num_likes=like_count)
+            except IntegrityError:
+                # a toggle of the same user committed its like in between, toggle again on top of it
+                if attempt:
+                    raise
+                continue
+            return post, is_liked, like_count
+
+    @classmethod
+    def repair_counts(cls, post_ids=None):
+        """Recompute like_count and comment_count from the source tables, returns the number of posts fixed."""
+        post_qs = cls.objects.all()
+        like_qs = cls.likes.through.objects.all()
+        comment_qs = Comment.objects.all()
+        if post_ids is not None:
+            post_qs = post_qs.filter(id__in=post_ids)
+            like_qs = like_qs.filter(post_id__in=post_ids)
+            comment_qs = comment_qs.filter(post_id__in=post_ids)
+        like_counts = dict(like_qs.order_by().values_list('post_id').annotate(num=Count('id')))
+        comment_counts = dict(comment_qs.order_by().values_list('post_id').annotate(num=Count('id')))
+        num_fixed = 0
+        with transaction.atomic():
+            for post_id, like_count, comment_count in post_qs.values_list('id', *cls.COUNT_FIELDS):
+                counts = (like_counts.get(post_id, 0), comment_counts.get(post_id, 0))
+                if counts != (like_count, comment_count):
+                    cls.objects.filter(id=post_id).update(like_count=counts[0], comment_count=counts[1])
+                    num_fixed += 1
+        return num_fixed
+
     class Meta:
         ordering = ('created_at',)
+        indexes = [
+            models.Index(fields=['is_approved', '-created_at'], name='post_approved_created_idx'),
+            models.Index(fields=['district', 'is_approved'], name='post_district_approved_idx'),
+            models.Index(fields=['subject', 'is_approved'], name='post_subject_approved_idx'),
+            models.Index(fields=['class_level', 'is_approved'], name='post_class_approved_idx'),
+            models.Index(fields=['is_approved', '-like_count', '-created_at'], name='post_approved_likes_idx'),
+            # the posts of a profile
+            models.Index(fields=['author', 'is_approved', '-created_at'], name='post_author_approved_idx'),
+        ]
 
 
 class Comment(models.Model):
@@ -45,3 +170,80 @@ class Comment(models.Model):
 
     def __str__(self):
         return self.text
+
+
+class ModerationBatch(models.Model):
+    APPROVE = 'approve'
+    REJECT = 'reject'
+    ACTION_CHOICES = (
+        (APPROVE, 'approve'),
+        (REJECT, 'reject')
+    )
+
+    moderator = models.ForeignKey(User, null=True, related_name='moderation_batches')
+    action = models.CharField(choices=ACTION_CHOICES, max_length=10)
+    num_posts = models.IntegerField(default=0)
+    # what was selected: the post ids or the queue filter the batch was run on
+    selection = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "{} {} posts by {}".format(self.action, self.num_posts, self.moderator)
+
+    @classmethod
+    def moderate(cls, moderator, post_qs, action, selection=''):
+        """
+        Approve or reject every pending post of post_qs with a single UPDATE / DELETE and record
+        the batch. Rejected posts are deleted, like a moderator deleting them one by one.
+        """
+        post_qs = post_qs.filter(is_approved=False)
+        with transaction.atomic():
+            if action == cls.APPROVE:
+                # update() leaves created_at alone, saving each post would bump it through auto_now
+                num_posts = post_qs.update(is_approved=True)
+            else:
+                Notify.delete_noties(Notify.objects.filter(noti_post__in=post_qs.values('id')))
+                # delete() also counts the likes and comments it cascades to
+                num_posts = post_qs.delete()[1].get(Post._meta.label, 0)
+            batch = cls.objects.create(
+                moderator=moderator,
+                action=action,
+                num_posts=num_posts,
+                selection=selection
+            )
+        # update() sends no signals; the cached post cards don't show whether a post is approved
+        cache.delete(NUM_PENDING_CACHE_KEY)
+        bump_fragment_version('post_facets')
+        return batch
+
+
+# the cached card parts show the author and the post's own fields, not its likes or comments
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_cards(sender, **kwargs):
+    bump_fragment_version('post_card')
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_num_pending(sender, **kwargs):
+    cache.delete(NUM_PENDING_CACHE_KEY)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_facets(sender, instance, signal, **kwargs):
+    version = bump_fragment_version('post_facets')
+    matching.post_changed(instance, version, deleted=signal is post_delete)
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'title', 'text'} & set(update_fields):
+        return
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_text(sender, instance, **kwargs):
+    search.unindex_post(instance.id)
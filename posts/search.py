@@ -0,0 +1,107 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+# full-text index over Post.title and Post.text, an SQLite FTS5 table whose rowid is the post id.
+# It is kept in sync by the Post signals in posts.models, rebuild_post_search repairs it.
+POST_FTS_TABLE = 'posts_post_fts'
+
+# bm25 weights of the title and text columns, a hit in the title counts more
+TITLE_WEIGHT = 5.0
+TEXT_WEIGHT = 1.0
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_supported(conn=connection):
+    return conn.vendor == 'sqlite'
+
+
+def create_index(conn=connection):
+    if not fts_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(title, text, '
+            "tokenize = 'unicode61 remove_diacritics 2')".format(POST_FTS_TABLE)
+        )
+
+
+def drop_index(conn=connection):
+    if not fts_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS {}'.format(POST_FTS_TABLE))
+
+
+def rebuild_index(conn=connection):
+    """Refill the index from posts_post, returns the number of indexed posts."""
+    if not fts_supported(conn):
+        return 0
+    create_index(conn)
+    with conn.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(POST_FTS_TABLE))
+        cursor.execute(
+            'INSERT INTO {}(rowid, title, text) '
+            "SELECT id, title, COALESCE(text, '') FROM posts_post".format(POST_FTS_TABLE)
+        )
+        cursor.execute('SELECT COUNT(*) FROM {}'.format(POST_FTS_TABLE))
+        return cursor.fetchone()[0]
+
+
+def index_post(post):
+    if not fts_supported():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(POST_FTS_TABLE), [post.id])
+        cursor.execute(
+            'INSERT INTO {}(rowid, title, text) VALUES (%s, %s, %s)'.format(POST_FTS_TABLE),
+            [post.id, post.title, post.text or '']
+        )
+
+
+def unindex_post(post_id):
+    if not fts_supported():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(POST_FTS_TABLE), [post_id])
+
+
+def get_words(keywords):
+    return WORD_RE.findall(keywords or '')
+
+
+def match_query(words):
+    """
+    Every word has to appear, the last one may be the start of a word. Words are quoted so that
+    nothing the user types is read as FTS5 query syntax.
+    """
+    terms = ['"{}"'.format(word) for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_posts(post_qs, keywords):
+    """
+    Restrict post_qs to the posts matching keywords and annotate them with text_rank, the bm25
+    score of the match (lower is better). Other databases fall back to icontains with a constant
+    text_rank.
+    """
+    words = get_words(keywords)
+    if not words:
+        return post_qs
+    if fts_supported():
+        return post_qs.extra(
+            select={'text_rank': 'bm25({}, %s, %s)'.format(POST_FTS_TABLE)},
+            select_params=(TITLE_WEIGHT, TEXT_WEIGHT),
+            tables=[POST_FTS_TABLE],
+            # the unary + keeps SQLite from looking the match up again for every post, it scans
+            # the match once and finds the posts by primary key
+            where=['posts_post.id = +{0}.rowid'.format(POST_FTS_TABLE),
+                   '{0} MATCH %s'.format(POST_FTS_TABLE)],
+            params=[match_query(words)]
+        )
+    for word in words:
+        post_qs = post_qs.filter(Q(title__icontains=word) | Q(text__icontains=word))
+    return post_qs.extra(select={'text_rank': '0'})
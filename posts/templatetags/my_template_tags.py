@@ -1,9 +1,7 @@
-from operator import attrgetter
-
 from django import template
+from django.db.models import Count
 
-from accounts.models import User
-from infos.models import District, Notify
+from infos.models import District, RatingSummary
 from posts.forms import PostSearchForm
 
 register = template.Library()
@@ -16,17 +14,12 @@ def get_search_form():
     }
 
 
-@register.inclusion_tag('accounts/rating_user_list.html')
-def show_rating_list(number_result):
-    user_list = User.objects.filter(is_tutor=True).all()
-    rank_list = []
-    for user in user_list:
-        user.rank = user.calculate_avg_rating()
-        rank_list.append(user)
-    rank_list.sort(key=attrgetter('rank'), reverse=True)
-    result_list = rank_list[:number_result]
+@register.inclusion_tag('accounts/rating_user_list.html', takes_context=True)
+def show_rating_list(context, number_result):
     return {
-        'rating_user_list': result_list
+        'rating_user_list': RatingSummary.top_tutors(number_result),
+        # the format picture_url serves, the sidebar is cached per format
+        'picture_format': context.get('picture_format', 'jpg')
     }
 
 
@@ -37,14 +30,16 @@ def get_item(dictionary, key):
 
 @register.inclusion_tag('district_user_index.html')
 def show_district_user_list():
-    district_list = District.objects.all()
+    district_list = District.objects.annotate(num_users=Count('district_users'))
     return {
         'district_list': district_list
     }
 
 
-@register.assignment_tag
-def get_user_noties(user):
-    noti_list = Notify.objects.filter(to_user=user).all().order_by('-noti_date')
-    return noti_list
-
+@register.simple_tag(takes_context=True)
+def picture_url(context, user, size):
+    """{% picture_url user 64 %}: url of the user's picture variant for a circle of about 64px."""
+    if user.is_anonymous:
+        # like {{ user.picture.url }} did
+        return ''
+    return user.get_picture_url(size, context.get('picture_format', 'jpg'))
@@ -1,2 +1,620 @@
-from django.test import TestCase
+import itertools
+import re
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
 
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import User
+from final_project.test_utils import explain
+from infos.models import ClassLevel, District, Notify, Rating, RatingSummary, Subject
+from . import matching
+from .forms import PostSearchForm
+from .matching import PostMatchIndex
+from .models import Comment, ModerationBatch, Post
+from .views import LIKERS_SHOWN, FilterPost, find_post
+
+# a full pass over the table, as opposed to SEARCH or SCAN ... USING INDEX. Older SQLite says SCAN TABLE
+TABLE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(posts_post|infos_rating)\b(?! USING)')
+
+
+def make_site(num_posts=30):
+    """Reference data, a student, a tutor rated by the student and num_posts posts, some pending."""
+    districts = [District.objects.create(name='District {}'.format(i)) for i in range(3)]
+    subjects = [Subject.objects.create(name='Subject {}'.format(i)) for i in range(3)]
+    class_levels = [ClassLevel.objects.create(class_level=level) for level in range(1, 4)]
+    student = User.objects.create_user('student', 'student@example.com', 'password', is_active=True)
+    tutor = User.objects.create_user('tutor', 'tutor@example.com', 'password', is_active=True, is_tutor=True)
+    Rating.objects.create(from_user=student, to_user=tutor, rating=4)
+    RatingSummary.rebuild()
+    for i in range(num_posts):
+        Post.objects.create(
+            title='Math lesson {}'.format(i),
+            text='Algebra and geometry for class {}'.format(i % 3 + 1),
+            author=tutor if i % 2 else student,
+            district=districts[i % 3],
+            subject=subjects[i % 3],
+            class_level=class_levels[i % 3],
+            is_approved=i % 5 != 0
+        )
+    return student, tutor
+
+
+def search_data():
+    """A search by district and subject, the posts of either come up."""
+    return {'district': District.objects.order_by('id')[0].id, 'subject': Subject.objects.order_by('id')[1].id}
+
+
+def add_activity(posts, users):
+    """Likes and comments of users on posts, with the counters kept."""
+    for i, post in enumerate(posts):
+        for user in users[:i % (len(users) + 1)]:
+            post.likes.add(user)
+            Comment.objects.create(post=post, author=user, text='Interested')
+        Post.repair_counts([post.id])
+
+
+# searches run in SQL instead of the in-memory match index, which would also be built from a
+# thread that can't see the test's data
+@skipUnless(connection.vendor == 'sqlite', 'reads the plans of SQLite')
+@override_settings(POST_MATCH_INDEX=False)
+class PostQueryPlanTests(TestCase):
+    """The main queries of the list pages go through the indexes, not over the whole table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.student, cls.tutor = make_site()
+
+    def setUp(self):
+        # counts and fragments cached by an earlier test would hide queries
+        cache.clear()
+        self.client.force_login(self.student)
+
+    def get_plans(self, url, data=None):
+        """Plan of every query of the page reading posts_post or infos_rating."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if sql.startswith('SELECT') and re.search(r'"(posts_post|infos_rating)"', sql):
+                plans.append((sql, explain(sql)))
+        self.assertTrue(plans)
+        return plans
+
+    def assertNoTableScan(self, plans):
+        for sql, plan in plans:
+            for detail in plan:
+                self.assertIsNone(TABLE_SCAN_RE.match(detail), '{}\n{}'.format(sql, '\n'.join(plan)))
+
+    def assertUsesIndex(self, plans, index_name):
+        self.assertTrue(any(index_name in detail for _, plan in plans for detail in plan),
+                        '{} unused:\n{}'.format(index_name, '\n\n'.join(
+                            '{}\n{}'.format(sql, '\n'.join(plan)) for sql, plan in plans)))
+
+    def test_home(self):
+        plans = self.get_plans(reverse('index'))
+        self.assertNoTableScan(plans)
+        self.assertUsesIndex(plans, 'post_approved_created_idx')
+
+    def test_search(self):
+        plans = self.get_plans(reverse('posts:search_post'), search_data())
+        self.assertNoTableScan(plans)
+        self.assertUsesIndex(plans, 'post_approved_likes_idx')
+
+    def test_search_keywords(self):
+        plans = self.get_plans(reverse('posts:search_post'), {'keywords': 'algebra'})
+        self.assertNoTableScan(plans)
+        self.assertUsesIndex(plans, 'posts_post_fts')
+
+    def test_profile(self):
+        plans = self.get_plans(reverse('accounts:profile', kwargs={'pk': self.tutor.id}))
+        self.assertNoTableScan(plans)
+        self.assertUsesIndex(plans, 'post_author_approved_idx')
+        # the student's own vote
+        self.assertUsesIndex(plans, 'SEARCH infos_rating USING INDEX')
+
+
+@override_settings(POST_MATCH_INDEX=False)
+class QueryCountTests(TestCase):
+    """The list pages run as many queries for a long page as for a short one."""
+    PAGE_SIZES = (2, 10)
+    # queries per page, with the session and user of the request
+    EXPECTED_QUERIES = {
+        'index': 11,
+        'search': 16,
+        'search_keywords': 12,
+        'profile': 14,
+        'approve': 6,
+        'district_users': 11,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.student, cls.tutor = make_site(num_posts=60)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password', is_active=True)
+        others = [User.objects.create_user('user{}'.format(i), is_active=True) for i in range(3)]
+        add_activity(Post.objects.order_by('id'), [cls.student, cls.tutor] + others)
+
+    def setUp(self):
+        self.client.force_login(self.student)
+
+    def get_page(self, name, page_size):
+        urls = {
+            'index': (reverse('index'), {}),
+            'search': (reverse('posts:search_post'), search_data()),
+            'search_keywords': (reverse('posts:search_post'), {'keywords': 'algebra'}),
+            'profile': (reverse('accounts:profile', kwargs={'pk': self.tutor.id}), {}),
+            'approve': (reverse('posts:approve'), {}),
+        }
+        url, data = urls[name]
+        # nothing cached from the other page size
+        cache.clear()
+        with mock.patch('final_project.views.POSTS_PER_PAGE', page_size), \
+                mock.patch('posts.views.POSTS_PER_PAGE', page_size), \
+                mock.patch('accounts.views.POSTS_PER_PAGE', page_size), \
+                self.assertNumQueries(self.EXPECTED_QUERIES[name]):
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['post_list']), page_size)
+        return response
+
+    def assertSameQueriesPerPageSize(self, name):
+        for page_size in self.PAGE_SIZES:
+            with self.subTest(page_size=page_size):
+                self.get_page(name, page_size)
+
+    def test_index(self):
+        self.assertSameQueriesPerPageSize('index')
+
+    def test_search(self):
+        self.assertSameQueriesPerPageSize('search')
+
+    def test_search_keywords(self):
+        self.assertSameQueriesPerPageSize('search_keywords')
+
+    def test_profile(self):
+        self.assertSameQueriesPerPageSize('profile')
+
+    def test_district_users(self):
+        district = District.objects.order_by('id')[0]
+        users = [User.objects.create_user('neighbour{}'.format(i), is_active=True, is_tutor=i % 2 == 0,
+                                          district=district) for i in range(12)]
+        for i, user in enumerate(users):
+            Rating.objects.create(from_user=users[i - 1], to_user=user, rating=i % 5 + 1)
+            Post.objects.create(title='Lesson {}'.format(i), author=user, district=district)
+        RatingSummary.rebuild()
+        for page_size in self.PAGE_SIZES:
+            with self.subTest(page_size=page_size):
+                cache.clear()
+                with mock.patch('final_project.views.USERS_PER_PAGE', page_size), \
+                        self.assertNumQueries(self.EXPECTED_QUERIES['district_users']):
+                    response = self.client.get(reverse('district_user', kwargs={'district_id': district.id}))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['user_list']), page_size)
+                self.assertContains(response, 'Posted: 1</h5>', count=page_size)
+
+    def test_approve(self):
+        self.client.force_login(self.admin)
+        self.assertSameQueriesPerPageSize('approve')
+        # counted as the superuser, not an anonymous visitor
+        self.assertContains(self.get_page('approve', 2), 'id="num-approve"')
+
+
+class ApproveCountTests(TestCase):
+    """The approval badge is refreshed from the cached count of pending posts."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.student, cls.tutor = make_site(num_posts=10)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password', is_active=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_num_approve(self, num_queries):
+        # with the session and user of the request
+        with self.assertNumQueries(num_queries):
+            response = self.client.get(reverse('posts:caculate_approve'))
+        self.assertEqual(response.status_code, 200)
+        return response.json()['num_approve']
+
+    def test_cached_count(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(self.get_num_approve(3), 2)
+        self.assertEqual(self.get_num_approve(2), 2)
+        post = Post.objects.filter(is_approved=False).order_by('id')[0]
+        post.is_approved = True
+        post.save()
+        self.assertEqual(self.get_num_approve(3), 1)
+
+    def test_superusers_only(self):
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(reverse('posts:caculate_approve')).status_code, 403)
+
+    @override_settings(APPROVE_POLL_INTERVAL=45, POST_MATCH_INDEX=False)
+    def test_poll_interval(self):
+        self.client.force_login(self.admin)
+        self.assertContains(self.client.get(reverse('index')), '}, 45000);')
+
+
+@override_settings(POST_MATCH_INDEX=False)
+class ModerationTests(TestCase):
+    """Bulk approve / reject from the approve page and the admin, recorded as ModerationBatch."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.student, cls.tutor = make_site(num_posts=20)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password', is_active=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+        self.pending_ids = list(Post.objects.filter(is_approved=False).order_by('id').values_list('id', flat=True))
+        # created long ago, approving must not make the posts look new
+        self.created_at = timezone.now() - timedelta(days=3)
+        Post.objects.filter(id__in=self.pending_ids).update(created_at=self.created_at)
+
+    def assertBatch(self, action, num_posts, selection):
+        batch = ModerationBatch.objects.get()
+        self.assertEqual(
+            (batch.moderator, batch.action, batch.num_posts, batch.selection),
+            (self.admin, action, num_posts, selection)
+        )
+
+    def test_approve_selected(self):
+        approved_id = Post.objects.filter(is_approved=True).values_list('id', flat=True)[0]
+        post_ids = self.pending_ids[:2] + [approved_id]
+        self.assertEqual(Post.get_num_pending(), 4)
+        response = self.client.post(reverse('posts:bulk_moderate'), {'action': 'approve', 'post_ids': post_ids})
+        self.assertRedirects(response, reverse('posts:approve'))
+        self.assertBatch(ModerationBatch.APPROVE, 2, ','.join(map(str, post_ids)))
+        approved = Post.objects.filter(id__in=self.pending_ids[:2])
+        self.assertTrue(all(post.is_approved and post.created_at == self.created_at for post in approved))
+        self.assertEqual(Post.get_num_pending(), 2)
+
+    def test_reject_filter(self):
+        tutor_posts = Post.objects.filter(id__in=self.pending_ids, author=self.tutor)
+        for post in tutor_posts:
+            post.likes.add(self.student)
+            Comment.objects.create(post=post, author=self.student, text='Interested')
+        response = self.client.post(
+            reverse('posts:bulk_moderate'),
+            {'action': 'reject', 'scope': 'filter', 'filter': 'tutor'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        # the likes and comments deleted along are not counted
+        self.assertEqual(response.json()['num_posts'], 2)
+        self.assertBatch(ModerationBatch.REJECT, 2, 'filter=tutor')
+        self.assertFalse(Post.objects.filter(id__in=self.pending_ids, author=self.tutor).exists())
+        self.assertEqual(Post.objects.filter(id__in=self.pending_ids).count(), 2)
+
+    def test_bad_requests(self):
+        response = self.client.post(reverse('posts:bulk_moderate'), {'action': 'delete', 'post_ids': self.pending_ids})
+        self.assertEqual(response.status_code, 400)
+        self.client.force_login(self.tutor)
+        self.client.post(reverse('posts:bulk_moderate'), {'action': 'approve', 'post_ids': self.pending_ids})
+        self.assertFalse(ModerationBatch.objects.exists())
+        self.assertEqual(Post.objects.filter(id__in=self.pending_ids, is_approved=False).count(), 4)
+
+    def run_admin_action(self, action, post_ids):
+        response = self.client.post(
+            reverse('admin:posts_post_changelist'),
+            {'action': action, '_selected_action': post_ids},
+            follow=True
+        )
+        return [str(message) for message in response.context['messages']]
+
+    def test_admin_approve(self):
+        self.assertEqual(self.run_admin_action('approve_posts', self.pending_ids[:3]), ['Approved 3 posts.'])
+        self.assertBatch(ModerationBatch.APPROVE, 3, 'admin action')
+        self.assertEqual(
+            list(Post.objects.filter(id__in=self.pending_ids[:3]).values_list('is_approved', 'created_at')),
+            [(True, self.created_at)] * 3
+        )
+
+    def test_admin_reject(self):
+        Comment.objects.create(post_id=self.pending_ids[0], author=self.student, text='Interested')
+        self.assertEqual(self.run_admin_action('reject_posts', self.pending_ids[:2]), ['Rejected 2 posts.'])
+        self.assertBatch(ModerationBatch.REJECT, 2, 'admin action')
+        self.assertEqual(Post.objects.filter(id__in=self.pending_ids).count(), 2)
+
+    def test_approve_post_keeps_created_at(self):
+        post_id = self.pending_ids[0]
+        response = self.client.get(reverse('posts:approve_post', kwargs={'pk': post_id}))
+        self.assertRedirects(response, reverse('posts:detail_post', kwargs={'pk': post_id}))
+        post = Post.objects.get(id=post_id)
+        self.assertEqual((post.is_approved, post.created_at), (True, self.created_at))
+        self.assertBatch(ModerationBatch.APPROVE, 1, str(post_id))
+
+
+@override_settings(POST_MATCH_INDEX=False)
+class FragmentCacheTests(TestCase):
+    """The cached post cards and facet counts follow a renamed district."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.student, cls.tutor = make_site()
+
+    def setUp(self):
+        cache.clear()
+
+    def get_facet_labels(self):
+        response = self.client.get(reverse('posts:search_post'), search_data())
+        self.assertEqual(response.status_code, 200)
+        return [facet['label'] for title, facet_values in response.context['facets'] if title == 'District'
+                for facet in facet_values]
+
+    def test_renamed_district(self):
+        district = District.objects.order_by('id')[0]
+        self.assertContains(self.client.get(reverse('index')), '<h4>District 0</h4>')
+        self.assertIn('District 0', self.get_facet_labels())
+
+        district.name = 'Renamed district'
+        district.save()
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, '<h4>Renamed district</h4>')
+        self.assertNotContains(response, '<h4>District 0</h4>')
+        labels = self.get_facet_labels()
+        self.assertIn('Renamed district', labels)
+        self.assertNotIn('District 0', labels)
+
+
+class PostDetailQueryTests(TestCase):
+    """A post's detail page costs the same queries however many comments and likes it has."""
+    NUM_COMMENTS = 500
+    NUM_LIKES = 5000
+    # post, comments, session, user, the reader's like, likers and the reference data of the sidebar
+    EXPECTED_QUERIES = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.student, cls.tutor = make_site(num_posts=2)
+        cls.post, cls.quiet_post = Post.objects.order_by('id')
+        # bulk_create skips the password hashing and the signals of create_user
+        User.objects.bulk_create(User(username='liker{}'.format(i), password='!', is_active=True)
+                                 for i in range(cls.NUM_LIKES))
+        liker_ids = list(User.objects.filter(username__startswith='liker').order_by('id').values_list('id', flat=True))
+        like_model = Post.likes.through
+        like_model.objects.bulk_create(like_model(post=cls.post, user_id=user_id) for user_id in liker_ids)
+        Comment.objects.bulk_create(Comment(post=cls.post, author_id=liker_ids[i], text='Comment {}'.format(i))
+                                    for i in range(cls.NUM_COMMENTS))
+        cls.quiet_post.likes.add(cls.tutor)
+        Comment.objects.create(post=cls.quiet_post, author=cls.tutor, text='Only comment')
+        Post.repair_counts()
+        cls.latest_liker_ids = liker_ids[::-1][:LIKERS_SHOWN]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.student)
+
+    def get_detail(self, post):
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get(reverse('posts:detail_post', kwargs={'pk': post.id}))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_busy_post(self):
+        response = self.get_detail(self.post)
+        self.assertEqual(response.context['num_likes'], self.NUM_LIKES)
+        self.assertEqual(response.context['num_comments'], self.NUM_COMMENTS)
+        # only the latest likers, the others are paged in on demand
+        self.assertEqual([user.id for user in response.context['likers']], self.latest_liker_ids)
+        # the script adding the reader on a like has one more
+        self.assertEqual(len(re.findall(r'<div id="user\d+" class="row">', response.content.decode())),
+                         LIKERS_SHOWN + 1)
+        self.assertContains(response, 'id="more-likers"')
+
+    def test_quiet_post(self):
+        response = self.get_detail(self.quiet_post)
+        self.assertEqual(len(response.context['likers']), 1)
+        self.assertNotContains(response, 'id="more-likers"')
+
+
+class ToggleLikeConcurrencyTests(TransactionTestCase):
+    """Likes of the same post toggled at once keep like_count and the like notification right."""
+    NUM_THREADS = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('threads wait for the locks of an SQLite database in a file only')
+        self.student, self.tutor = make_site(num_posts=1)
+        self.post = Post.objects.get()
+        self.users = [User.objects.create_user('liker{}'.format(i), is_active=True)
+                      for i in range(self.NUM_THREADS)]
+
+    def toggle_likes(self, toggles):
+        """Every user toggles their like toggles[user] times, all threads starting together."""
+        barrier = threading.Barrier(len(toggles))
+        errors = []
+
+        def toggle(user, times):
+            try:
+                barrier.wait()
+                for _ in range(times):
+                    Post.toggle_like(self.post.id, user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=toggle, args=item) for item in toggles.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_same_post(self):
+        # an odd number of toggles leaves the post liked
+        toggles = {user: i % 2 + 1 for i, user in enumerate(self.users)}
+        self.toggle_likes(toggles)
+        post = Post.objects.get(id=self.post.id)
+        self.assertEqual(post.like_count, post.likes.count())
+        self.assertEqual(sorted(post.likes.values_list('id', flat=True)),
+                         sorted(user.id for user, times in toggles.items() if times % 2))
+        like_noties = Notify.objects.filter(noti_type=Notify.LIKE, noti_post=post)
+        self.assertEqual(like_noties.count(), 1)
+        self.assertEqual(like_noties.get().to_user_id, post.author_id)
+
+    def test_all_taken_back(self):
+        self.toggle_likes({user: 2 for user in self.users})
+        post = Post.objects.get(id=self.post.id)
+        self.assertEqual((post.like_count, post.likes.count()), (0, 0))
+        self.assertFalse(Notify.objects.filter(noti_type=Notify.LIKE, noti_post=post).exists())
+
+
+def make_match_site():
+    """
+    make_site without posts, then posts over every combination of district, subject and class
+    level, some without one, created in a different order than their ids.
+    """
+    student, tutor = make_site(num_posts=0)
+    field_values = [[None] + list(model.objects.order_by('id')) for model in (District, Subject, ClassLevel)]
+    for i, (district, subject, class_level) in enumerate(itertools.product(*field_values)):
+        Post.objects.create(
+            title='Lesson {}'.format(i),
+            author=tutor if i % 3 else student,
+            district=district,
+            subject=subject,
+            class_level=class_level,
+            is_approved=i % 7 != 0
+        )
+    # auto_now can give posts created together the same time, spread them out
+    now = timezone.now()
+    post_ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+    for i, post_id in enumerate(post_ids):
+        Post.objects.filter(id=post_id).update(created_at=now - timedelta(minutes=i * 17 % len(post_ids)))
+    return student, tutor
+
+
+class MatchIndexAssertions:
+    def get_search_values(self):
+        # nothing, a value and another one per field are enough for every way the ranks combine
+        return itertools.product(*(
+            [None] + list(model.objects.order_by('id').values_list('id', flat=True)[:2])
+            for model in (District, Subject, ClassLevel)
+        ))
+
+    def assertMatchesSql(self, index):
+        """index.match returns the posts, counts and order of find_post in SQL for every search."""
+        for values in self.get_search_values():
+            form = PostSearchForm(dict(zip(('district', 'subject', 'class_level'), values)))
+            self.assertTrue(form.is_valid())
+            for filter_param in FilterPost:
+                with self.subTest(values=values, filter=filter_param.name):
+                    with override_settings(POST_MATCH_INDEX=False):
+                        sql_result = find_post(form, filter_param.value)
+                    sql_posts = [(post.id, post.rank) for post in sql_result['rank_posts']]
+                    is_tutor = {FilterPost.STUDENT: False, FilterPost.TUTOR: True}.get(filter_param)
+                    match_result = index.match(*values, is_tutor=is_tutor)
+                    self.assertEqual((match_result.num_results, match_result.matches),
+                                     (sql_result['num_results'], sql_result['matches']))
+                    self.assertEqual([(post.id, post.rank) for post in match_result[:]], sql_posts)
+
+
+@override_settings(POST_MATCH_INDEX=True)
+class PostMatchIndexTests(MatchIndexAssertions, TestCase):
+    """The bitmaps rank the posts like the SQL of find_post."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.student, cls.tutor = make_match_site()
+
+    def setUp(self):
+        cache.clear()
+        self.index = PostMatchIndex.build(matching.get_fragment_versions()['post_facets'])
+
+    def test_build(self):
+        approved_ids = Post.objects.filter(is_approved=True).values_list('id', flat=True)
+        self.assertEqual(set(self.index.post_slots), set(approved_ids))
+        self.assertEqual(matching.popcount(self.index.all), len(self.index.post_slots))
+        self.assertEqual(matching.popcount(self.index.tutors),
+                         Post.objects.filter(is_approved=True, author=self.tutor).count())
+
+    def test_match(self):
+        self.assertMatchesSql(self.index)
+
+    def test_pages(self):
+        values = [model.objects.order_by('id')[0].id for model in (District, Subject, ClassLevel)]
+        match_result = self.index.match(*values)
+        ranked_ids = [post.id for post in match_result[:]]
+        # pages starting and ending inside the tiers of every rank
+        for start, stop in ((0, 1), (1, 5), (3, 11), (10, 40), (len(ranked_ids) - 2, len(ranked_ids) + 5)):
+            with self.subTest(start=start, stop=stop):
+                self.assertEqual([post.id for post in match_result[start:stop]], ranked_ids[start:stop])
+        self.assertEqual(match_result[2].id, ranked_ids[2])
+        self.assertEqual([rank for rank, _, _ in match_result.tiers], [3, 2, 1])
+
+    def test_slots_desc(self):
+        bitmap = matching.bitmap_from_slots([0, 3, 4, 9, 17], 20)
+        self.assertEqual(matching.slots_desc(bitmap, 0, 10), [17, 9, 4, 3, 0])
+        self.assertEqual(matching.slots_desc(bitmap, 1, 2), [9, 4])
+        self.assertEqual(matching.slots_desc(bitmap, 5, 2), [])
+        self.assertEqual(matching.slots_desc(0, 0, 2), [])
+
+    def test_find_post_uses_index(self):
+        form = PostSearchForm({'district': District.objects.order_by('id')[1].id})
+        self.assertTrue(form.is_valid())
+        with mock.patch('posts.matching._index', self.index):
+            result = find_post(form, FilterPost.ALL.value)
+        self.assertIsInstance(result['rank_posts'], matching.MatchResult)
+
+
+@override_settings(POST_MATCH_INDEX=True)
+class PostMatchIndexUpdateTests(MatchIndexAssertions, TransactionTestCase):
+    """A loaded index takes in saved and deleted posts once they commit, instead of a rebuild."""
+
+    def setUp(self):
+        cache.clear()
+        self.student, self.tutor = make_match_site()
+        index = PostMatchIndex.build(matching.get_fragment_versions()['post_facets'])
+        patcher = mock.patch('posts.matching._index', index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertIndexCurrent(self):
+        # still the loaded index, none is rebuilt
+        index = matching.get_index()
+        self.assertIs(index, matching._index)
+        self.assertMatchesSql(index)
+
+    def test_saved_post(self):
+        post = Post.objects.filter(is_approved=True).order_by('created_at')[0]
+        post.district = District.objects.order_by('id')[2]
+        post.save()
+        self.assertIndexCurrent()
+        # moved up to the newest slot
+        self.assertEqual(matching._index.slot_post_ids[-1], post.id)
+
+    def test_new_post(self):
+        Post.objects.create(title='New lesson', author=self.tutor, subject=Subject.objects.order_by('id')[0],
+                            is_approved=True)
+        self.assertIndexCurrent()
+
+    def test_deleted_post(self):
+        post = Post.objects.filter(is_approved=True).order_by('id')[0]
+        post.delete()
+        self.assertNotIn(post.id, matching._index.post_slots)
+        self.assertIndexCurrent()
+
+    def test_unapproved_post(self):
+        post = Post.objects.filter(is_approved=True).order_by('id')[0]
+        post.is_approved = False
+        post.save()
+        self.assertNotIn(post.id, matching._index.post_slots)
+        self.assertIndexCurrent()
+
+    def test_approved_post(self):
+        post = Post.objects.filter(is_approved=False).order_by('id')[0]
+        post.is_approved = True
+        post.save()
+        self.assertIn(post.id, matching._index.post_slots)
+        self.assertIndexCurrent()
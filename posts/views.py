@@ -1,19 +1,24 @@
 from enum import Enum
-from operator import attrgetter
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.core.urlresolvers import reverse
-from django.db.models import Q
-from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Q, Sum, Value, When
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.shortcuts import redirect
 from django.views.generic import CreateView, DetailView, UpdateView, DeleteView
 
-from infos.models import Notify
+from final_project.pagination import CursorPaginator
+from infos.fragment_cache import get_fragment_versions
+from infos.models import CommentNotiJob, Notify
+from . import matching, search
+from .facets import get_facets
 from .forms import CommentForm, PostSearchForm
-from .models import Post, Comment
+from .models import Post, Comment, ModerationBatch
 
 
 class UserCreatePostView(LoginRequiredMixin, CreateView):
@@ -33,23 +38,64 @@ class UserCreatePostView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
+# likers listed on the detail page, the rest are paged in from post_likers_view
+LIKERS_SHOWN = 20
+LIKERS_PER_PAGE = 50
+
+
 class DetailPostView(DetailView):
     model = Post
     context_object_name = 'post'
     template_name = 'posts/post_detail.html'
 
+    def get_queryset(self):
+        return Post.objects.select_related('author', 'district', 'subject', 'class_level')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['comments'] = Comment.objects.filter(
-            post_id__exact=self.kwargs['pk']
-        ).order_by(
-            '-created_date'
-        )
-        post = get_object_or_404(Post, id=self.kwargs['pk'])
-        context['is_liked'] = post.likes.filter(id=self.request.user.id).exists()
+        post = self.object
+        comments = list(post.post_comments.select_related('author').order_by('-created_date'))
+        context['comments'] = comments
+        context['num_comments'] = len(comments)
+        context['num_likes'] = post.like_count
+        context['is_liked'] = (self.request.user.is_authenticated and
+                               post.likes.filter(id=self.request.user.id).exists())
+        context['likers'], context['likers_before'] = get_likers(post, LIKERS_SHOWN)
         return context
 
 
+def get_likers(post, limit, before=None):
+    """
+    Up to limit users who liked post, latest first, and the cursor of the next ones (None when
+    there are no more). before is such a cursor, the id of the like to continue after.
+    """
+    like_qs = Post.likes.through.objects.filter(post=post).select_related('user').order_by('-id')
+    if before is not None:
+        like_qs = like_qs.filter(id__lt=before)
+    likes = list(like_qs[:limit + 1])
+    next_before = likes[limit - 1].id if len(likes) > limit else None
+    return [like.user for like in likes[:limit]], next_before
+
+
+def post_likers_view(request, post_id):
+    post = get_object_or_404(Post, pk=post_id)
+    before = request.GET.get('before', '')
+    likers, next_before = get_likers(post, LIKERS_PER_PAGE, int(before) if before.isdigit() else None)
+    data = {
+        "likers": [
+            {
+                "id": user.id,
+                "username": user.username,
+                "picture": user.get_picture_url(50),
+                "url": reverse('accounts:profile', kwargs={'pk': user.id})
+            }
+            for user in likers
+        ],
+        "next_before": next_before
+    }
+    return JsonResponse(data=data)
+
+
 class EditPostView(LoginRequiredMixin, UpdateView):
     model = Post
     fields = (
@@ -80,34 +126,32 @@ class DeletePostView(LoginRequiredMixin, DeleteView):
         if not request.user.is_superuser and post.author != request.user:
             return HttpResponse("you dont have permission")
         success_url = self.get_success_url()
+        # the post's notifications cascade away with it, take them off the unread counters first
+        Notify.delete_noties(Notify.objects.filter(noti_post=post))
         super().delete(request, *args, **kwargs)
         return HttpResponseRedirect(success_url)
 
 
 def comment_on_post(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
-    post_author = post.author
-    other_comments = post.post_comments.all()
-    to_users = []
-    for cmt in other_comments:
-        to_users.append(cmt.author)
-    if not post_author in to_users:
-        to_users.append(post_author)
     comment_form = CommentForm(request.POST)
     if comment_form.is_valid():
         comment = comment_form.save(commit=False)
-        comment.post = post
+        # loads the user, outside the transaction: a read before its first write keeps a stale
+        # SQLite snapshot that can no longer write when another request commits meanwhile
         comment.author = request.user
-        comment.save()
-        for to_user in to_users:
-            if to_user != request.user:
-                Notify.objects.create(
-                    from_user=request.user,
-                    to_user=to_user,
-                    noti_type=Notify.COMMENT,
-                    noti_post=post,
-                    seen=False
-                )
+        with transaction.atomic():
+            # the counter update goes first and locks the post row, the comments of the post then
+            # queue here and two first comments can't both create the same notification rows
+            Post.add_to_counts(post.id, comment_count=1)
+            post = get_object_or_404(Post.objects.select_for_update(), id=post.id)
+            comment.post = post
+            comment.save()
+            background_min_comments = settings.COMMENT_NOTI_BACKGROUND_MIN_COMMENTS
+            if background_min_comments is not None and post.comment_count >= background_min_comments:
+                CommentNotiJob.enqueue(post, request.user)
+            else:
+                Notify.update_comment_noties(post, new_actor=request.user)
         return redirect(post.get_absolute_url())
 
 
@@ -124,72 +168,55 @@ def edit_comment(request, post_id, comment_id):
 
 
 def delete_comment(request, post_id, comment_id):
-    comment = get_object_or_404(Comment, pk=comment_id)
-    post = get_object_or_404(Post, pk=post_id)
+    # a comment id from another post's url is a 404, not a hit on that post's counts
+    comment = get_object_or_404(Comment.objects.select_related('post'), pk=comment_id, post_id=post_id)
+    post = comment.post
     if request.user != comment.author and request.user != post.author:
         return HttpResponse("you dont have permission")
-    url = comment.post.get_absolute_url()
-    comment.delete()
-    to_user = post.author
-    Notify.objects.filter(
-        from_user=request.user,
-        to_user=to_user,
-        noti_type=Notify.COMMENT,
-        noti_post=post,
-    ).delete()
+    url = post.get_absolute_url()
+    with transaction.atomic():
+        comment.delete()
+        Post.add_to_counts(post.id, comment_count=-1)
+        Notify.update_comment_noties(post)
     return redirect(url)
 
 
 @login_required()
 def like(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    user = request.user
-    to_user = post.author
-    if post.likes.filter(id=request.user.id).exists():
-        post.likes.remove(user)
-        is_liked = False
-        Notify.objects.filter(
-            from_user=request.user,
-            to_user=to_user,
-            noti_type=Notify.LIKE,
-            noti_post=post
-        ).delete()
-    else:
-        post.likes.add(user)
-        is_liked = True
-        # add noti
-        if to_user != request.user:
-            Notify.objects.create(
-                from_user=request.user,
-                to_user=to_user,
-                noti_type=Notify.LIKE,
-                noti_post=post,
-                seen=False
-            )
+    try:
+        post, is_liked, num_liked = Post.toggle_like(post_id, request.user)
+    except Post.DoesNotExist:
+        raise Http404("No post matches the given query.")
     data = {
         "is_liked": is_liked,
-        "num_liked": post.likes.count()
+        "num_liked": num_liked
     }
     return JsonResponse(data=data)
 
 
 def caculate_approve(request):
-    num_approve = Post.objects.filter(is_approved=False).count()
+    """
+    Number of posts waiting for approval, superusers only, from the cached count. The pages ask
+    again every APPROVE_POLL_INTERVAL seconds.
+    """
+    if not request.user.is_superuser:
+        return JsonResponse(data={"error": "you don't have permisson!"}, status=403)
+    num_approve = Post.get_num_pending()
     data = {
         "num_approve": num_approve
     }
     return JsonResponse(data=data)
 
 
-def count_true_field(post_obj, district_val, subject_val, class_val):
-    count = 0
-    if district_val == None or post_obj.district == district_val:
-        count += 1
-    if subject_val == None or post_obj.subject == subject_val:
-        count += 1
-    if class_val == None or post_obj.class_level == class_val:
-        count += 1
-    return count
+def match_field(field_name, value):
+    """1 when the post matches the searched value (or nothing was searched for this field), else 0."""
+    if value is None:
+        return Value(1, output_field=IntegerField())
+    return Case(
+        When(**{field_name: value}, then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField()
+    )
 
 
 class FilterPost(Enum):
@@ -202,40 +229,96 @@ def find_post(form, filter_param):
     district_val = form.cleaned_data['district']
     subject_val = form.cleaned_data['subject']
     class_level_val = form.cleaned_data['class_level']
-    if filter_param == FilterPost.ALL.value:
-        post_result = Post.objects.filter(
-            Q(district=district_val) | Q(subject=subject_val) | Q(class_level=class_level_val),
-            is_approved=True
-        ).order_by('-created_at')
-    elif filter_param == FilterPost.STUDENT.value:
-        post_result = Post.objects.filter(
-            Q(district=district_val) | Q(subject=subject_val) | Q(class_level=class_level_val),
-            is_approved=True,
-            author__is_tutor=False
-        ).order_by('-created_at')
+    # only the words count, a query of punctuation alone is no keyword search
+    keywords = ' '.join(search.get_words(form.cleaned_data.get('keywords')))
+    post_result = Post.objects.filter(is_approved=True)
+    if keywords:
+        post_result = search.search_posts(post_result, keywords)
+    if not keywords or district_val or subject_val or class_level_val:
+        post_result = post_result.filter(
+            Q(district=district_val) | Q(subject=subject_val) | Q(class_level=class_level_val)
+        )
+    if filter_param == FilterPost.STUDENT.value:
+        post_result = post_result.filter(author__is_tutor=False)
     elif filter_param == FilterPost.TUTOR.value:
-        post_result = Post.objects.filter(
-            Q(district=district_val) | Q(subject=subject_val) | Q(class_level=class_level_val),
-            is_approved=True,
-            author__is_tutor=True
-        ).order_by('-created_at')
-    rank_posts = []
-    matches = 0
-    for post in post_result:
-        post.rank = count_true_field(post, district_val, subject_val, class_level_val)
-        if post.rank == 3:
-            matches += 1
-        rank_posts.append(post)
-    num_results = len(rank_posts)
+        post_result = post_result.filter(author__is_tutor=True)
+
+    index = None if keywords else matching.get_index()
+    if index is not None:
+        is_tutor = {FilterPost.STUDENT.value: False, FilterPost.TUTOR.value: True}.get(filter_param)
+        match_result = index.match(
+            district_val and district_val.id,
+            subject_val and subject_val.id,
+            class_level_val and class_level_val.id,
+            is_tutor=is_tutor
+        )
+        return {'post_result': post_result, 'rank_posts': match_result, 'num_results': match_result.num_results,
+                'matches': match_result.matches, 'recommend': match_result.num_results - match_result.matches}
+
+    full_match = Q()
+    for field_name, value in (('district', district_val),
+                              ('subject', subject_val),
+                              ('class_level', class_level_val)):
+        if value is not None:
+            full_match &= Q(**{field_name: value})
+    if full_match:
+        counts = post_result.aggregate(
+            num_results=Count('id'),
+            matches=Sum(Case(When(full_match, then=Value(1)), default=Value(0), output_field=IntegerField()))
+        )
+    else:
+        counts = post_result.aggregate(num_results=Count('id'), matches=Count('id'))
+    num_results = counts['num_results']
+    matches = counts['matches'] or 0
     recommend = num_results - matches
-    rank_posts.sort(key=attrgetter('rank'), reverse=True)
-    dic_rank = {'rank_posts': rank_posts, 'matches': matches, 'recommend': recommend}
+
+    rank_posts = post_result.annotate(
+        rank=(
+            match_field('district', district_val) +
+            match_field('subject', subject_val) +
+            match_field('class_level', class_level_val)
+        )
+    )
+    if keywords:
+        # facet matches first, the best text matches first among them
+        rank_posts = rank_posts.order_by('-rank', 'text_rank', '-created_at')
+    else:
+        rank_posts = rank_posts.order_by('-rank', '-created_at')
+    rank_posts = rank_posts.select_related('author', 'district', 'subject', 'class_level')
+    dic_rank = {
+        'post_result': post_result,
+        'rank_posts': rank_posts,
+        'num_results': num_results,
+        'matches': matches,
+        'recommend': recommend
+    }
     return dic_rank
 
 
 POSTS_PER_PAGE = 4
 
 
+def facets_with_urls(request, facets):
+    """Attach to every facet value the search url narrowed down to it."""
+    def narrow_url(key, value):
+        params = request.GET.copy()
+        params.pop('page', None)
+        params[key] = value
+        return '?' + params.urlencode()
+
+    facet_links = []
+    for name, title in (('district', 'District'), ('subject', 'Subject'), ('class_level', 'Class level')):
+        facet_links.append((title, [
+            {'label': label, 'num_posts': num_posts, 'url': narrow_url(name, value)}
+            for value, label, num_posts in facets[name]
+        ]))
+    facet_links.append(('Posted by', [
+        {'label': label, 'num_posts': facets['author'][value], 'url': narrow_url('filter', value)}
+        for value, label in (('tutor', 'Tutors'), ('student', 'Students'))
+    ]))
+    return facet_links
+
+
 def search_post_view(request):
     filter = request.GET.get('filter')
     form = PostSearchForm(request.GET)
@@ -248,6 +331,8 @@ def search_post_view(request):
             filter = 'all'
             post_result_filter = find_post(form, FilterPost.ALL.value)
         paginator = Paginator(post_result_filter['rank_posts'], POSTS_PER_PAGE)
+        # find_post already counted the results, don't let the paginator run COUNT(*) again
+        paginator.count = post_result_filter['num_results']
         matches = post_result_filter['matches']
         recommend = post_result_filter['recommend']
         page = request.GET.get('page')
@@ -258,11 +343,16 @@ def search_post_view(request):
         except EmptyPage:
             post_list = paginator.page(paginator.num_pages)
 
-        like_dict = {}
-        for post in post_list:
-            is_liked = post.likes.filter(username=request.user.username).exists()
-            like_dict.update({post.id: is_liked})
+        Post.attach_list_stats(post_list, request.user)
 
+        facets = get_facets(
+            post_result_filter['post_result'],
+            form.cleaned_data['district'] and form.cleaned_data['district'].id,
+            form.cleaned_data['subject'] and form.cleaned_data['subject'].id,
+            form.cleaned_data['class_level'] and form.cleaned_data['class_level'].id,
+            form.cleaned_data['keywords'],
+            filter
+        )
         query = '&'.join(
             '{}={}'.format(key, value) for key, value in request.GET.items() if key != 'page'
         )
@@ -271,10 +361,10 @@ def search_post_view(request):
             'post_list': post_list,
             'paginator': paginator,
             'query': query,
-            'like_dict': like_dict,
             'filter_check': filter,
             'matches': matches,
-            'recommend': recommend
+            'recommend': recommend,
+            'facets': facets_with_urls(request, facets)
         }
         return render(request, 'posts/post_search.html', context)
     else:
@@ -285,42 +375,39 @@ def search_post_view(request):
                   )
 
 
-def admin_approve_post_view(request):
-    filter = request.GET.get('filter')
+def filter_pending_posts(filter):
     if filter == 'student':
         post_lists = Post.objects.filter(
             is_approved=False,
             author__is_tutor=False,
             author__is_superuser=False
-        ).order_by('-created_at').all()
+        )
     elif filter == 'tutor':
         post_lists = Post.objects.filter(
             is_approved=False,
             author__is_tutor=True
-        ).order_by('-created_at').all()
+        )
     else:
+        post_lists = Post.objects.filter(is_approved=False)
+    return post_lists
+
+
+def admin_approve_post_view(request):
+    filter = request.GET.get('filter')
+    if filter not in ('student', 'tutor'):
         filter = 'all'
-        post_lists = Post.objects.filter(is_approved=False).order_by('-created_at').all()
+    post_lists = filter_pending_posts(filter).select_related('author', 'district', 'subject', 'class_level')
 
-    paginator = Paginator(post_lists, POSTS_PER_PAGE)
-    page = request.GET.get('page')
-    try:
-        post_list = paginator.page(page)
-    except PageNotAnInteger:
-        post_list = paginator.page(1)
-    except EmptyPage:
-        post_list = paginator.page(paginator.num_pages)
-    like_dict = {}
-    for post in post_list:
-        is_liked = post.likes.filter(username=request.user.username).exists()
-        like_dict.update({post.id: is_liked})
+    count_cache_key = 'pending_posts_count:{}:{}'.format(filter, get_fragment_versions()['post_facets'])
+    paginator = CursorPaginator(post_lists, POSTS_PER_PAGE, ('-created_at', '-id'), count_cache_key=count_cache_key)
+    post_list = paginator.page(cursor=request.GET.get('cursor'), number=request.GET.get('page'))
+    Post.attach_list_stats(post_list, request.user)
     query = '&'.join(
-        '{}={}'.format(key, value) for key, value in request.GET.items() if key != 'page'
+        '{}={}'.format(key, value) for key, value in request.GET.items() if key not in ('page', 'cursor')
     )
     context = {
         'post_list': post_list,
         'paginator': paginator,
-        'like_dict': like_dict,
         'query': query,
         'filter_check': filter
     }
@@ -330,8 +417,41 @@ def admin_approve_post_view(request):
 def admin_approve_post(request, pk):
     if not request.user.is_superuser:
         return HttpResponse("you don't have permisson!")
-    post = Post.objects.get(id=pk)
-    post.is_approved = True
-    post.save()
+    post = get_object_or_404(Post, id=pk)
+    ModerationBatch.moderate(request.user, Post.objects.filter(id=post.id), ModerationBatch.APPROVE,
+                             selection=str(post.id))
     url = post.get_absolute_url()
     return redirect(url)
+
+
+def bulk_moderate_view(request):
+    """
+    Approve or reject pending posts in one statement. Either post_ids selects posts explicitly or,
+    with scope=filter, every pending post matching filter (all/student/tutor) is moderated.
+    """
+    if not request.user.is_superuser:
+        return HttpResponse("you don't have permisson!")
+    if request.method != 'POST':
+        return redirect('posts:approve')
+    action = request.POST.get('action')
+    if action not in (ModerationBatch.APPROVE, ModerationBatch.REJECT):
+        return HttpResponse("unknown action!", status=400)
+    if request.POST.get('scope') == 'filter':
+        filter = request.POST.get('filter')
+        if filter not in ('student', 'tutor'):
+            filter = 'all'
+        post_qs = filter_pending_posts(filter)
+        selection = 'filter={}'.format(filter)
+    else:
+        post_ids = [post_id for post_id in request.POST.getlist('post_ids') if post_id.isdigit()]
+        post_qs = Post.objects.filter(id__in=post_ids)
+        selection = ','.join(post_ids)
+    batch = ModerationBatch.moderate(request.user, post_qs, action, selection=selection)
+    if request.is_ajax():
+        data = {
+            "batch_id": batch.id,
+            "action": batch.action,
+            "num_posts": batch.num_posts
+        }
+        return JsonResponse(data=data)
+    return redirect('posts:approve')